@@ -0,0 +1,190 @@
+import io
+import os
+from datetime import timedelta, timezone
+from decimal import Decimal
+from urllib.parse import urlparse
+import pandas as pd
+
+# Table -> column the archive is partitioned on. Rows are archived once that column falls
+# behind the retention cutoff, hour by hour; files already written are never rewritten.
+ARCHIVED_TABLES = {"posts": "posted", "comments": "posted", "updates": "posted", "tickers": "date"}
+# Table -> column stamped with when a row was written. A row can land after the watermark has
+# passed its hour (a spool replayed after an outage); these are archived by the next run.
+ARRIVAL_COLUMNS = {"posts": "ingested", "comments": "ingested"}
+
+
+class LocalStore:
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        with open(os.path.join(self.root, key), "rb") as f:
+            return f.read()
+
+    def list(self, prefix):
+        directory = os.path.join(self.root, prefix)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(f"{prefix}/{name}" for name in os.listdir(directory) if name.endswith(".parquet"))
+
+
+class S3Store:
+    def __init__(self, bucket, prefix="", **client_kwargs):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3 = boto3.client("s3", **client_kwargs)
+
+    def full_key(self, key):
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def put(self, key, data):
+        self.s3.put_object(Bucket=self.bucket, Key=self.full_key(key), Body=data)
+
+    def get(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=self.full_key(key))["Body"].read()
+
+    def list(self, prefix):
+        keys = []
+        paginator = self.s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.full_key(prefix) + "/"):
+            for item in page.get("Contents", []):
+                keys.append(item["Key"][len(self.full_key("")) :])
+        return sorted(keys)
+
+
+def store_from_url(url):
+    # s3://bucket/prefix (ARCHIVE_S3_ENDPOINT points it at any S3-compatible service) or a local path.
+    parsed = urlparse(url)
+    if parsed.scheme == "s3":
+        client_kwargs = {}
+        if os.environ.get("ARCHIVE_S3_ENDPOINT"):
+            client_kwargs["endpoint_url"] = os.environ["ARCHIVE_S3_ENDPOINT"]
+        return S3Store(parsed.netloc, parsed.path, **client_kwargs)
+    return LocalStore(parsed.path if parsed.scheme == "file" else url)
+
+
+def hour_prefix(table, hour):
+    return f"{table}/{hour:%Y-%m-%d}/{hour:%H}"
+
+
+def to_frame(rows, columns):
+    df = pd.DataFrame(rows, columns=columns)
+    for column in columns:
+        first = df[column].dropna()
+        if len(first) > 0 and isinstance(first.iloc[0], Decimal):
+            df[column] = df[column].astype(float)
+    return df
+
+
+class Archiver:
+    def __init__(self, connection, store, chunk_size=20000, compression="snappy"):
+        self.connection = connection
+        self.store = store
+        self.chunk_size = chunk_size
+        self.compression = compression
+
+    def archive(self, cutoff):
+        cutoff = cutoff.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        return {table: self.archive_table(table, column, cutoff) for table, column in ARCHIVED_TABLES.items()}
+
+    def archive_table(self, table, column, cutoff):
+        name = f"archive_{table}"
+        arrival = ARRIVAL_COLUMNS.get(table)
+        start = self.watermark(name)
+        if arrival is None and start is not None and start >= cutoff:
+            return 0
+        if arrival is None:
+            where = f"{column} < %(cutoff)s AND (%(start)s::timestamptz IS NULL OR {column} >= %(start)s)"
+        else:
+            # Everything before the cutoff written up to now, less what earlier runs archived:
+            # rows before their cutoff written up to their start.
+            where = f"""
+                {column} < %(cutoff)s AND COALESCE({arrival}, '-infinity') <= %(arrived)s
+                AND NOT (%(start)s::timestamptz IS NOT NULL AND {column} < %(start)s
+                         AND COALESCE({arrival}, '-infinity') <= %(since)s)
+            """
+        archived = 0
+        parts = {}
+        self.connection.autocommit = False
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT now()")
+                arrived = cursor.fetchone()[0]
+            since = self.watermark(f"{name}_arrived") if arrival is not None else None
+            # A named cursor streams rows from the server chunk_size at a time.
+            with self.connection.cursor(name=f"{name}_cursor") as cursor:
+                cursor.itersize = self.chunk_size
+                cursor.execute(
+                    f"SELECT * FROM {table} WHERE {where} ORDER BY {column};",
+                    {"cutoff": cutoff, "start": start, "arrived": arrived, "since": since},
+                )
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    columns = [x[0] for x in cursor.description]
+                    archived += self.write_chunk(table, column, to_frame(rows, columns), parts, arrived)
+            self.connection.commit()
+        finally:
+            self.connection.autocommit = True
+        self.store_watermark(name, cutoff)
+        if arrival is not None:
+            self.store_watermark(f"{name}_arrived", arrived)
+        return archived
+
+    def watermark(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT watermark FROM rollup_watermarks WHERE name = %s", [name])
+            row = cursor.fetchone()
+        return row[0] if row is not None else None
+
+    def store_watermark(self, name, watermark):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO rollup_watermarks (name, watermark) VALUES (%s, %s)
+                ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark;
+                """,
+                [name, watermark],
+            )
+
+    def write_chunk(self, table, column, df, parts, run):
+        hours = df[column].dt.tz_convert("UTC").dt.floor(pd.Timedelta(hours=1))
+        for hour, group in df.groupby(hours, sort=True):
+            part = parts.get(hour, 0)
+            parts[hour] = part + 1
+            buf = io.BytesIO()
+            group.to_parquet(buf, index=False, compression=self.compression)
+            # Named after the run, so late rows add files to an hour already archived. A run
+            # that fails before storing its watermark is archived again by the next one.
+            key = f"{hour_prefix(table, hour)}/part-{run:%Y%m%d%H%M%S%f}-{part:05d}.parquet"
+            self.store.put(key, buf.getvalue())
+        return len(df)
+
+
+def load_range(store, table, start, end):
+    column = ARCHIVED_TABLES[table]
+    start = start.astimezone(timezone.utc) if start.tzinfo else start.replace(tzinfo=timezone.utc)
+    end = end.astimezone(timezone.utc) if end.tzinfo else end.replace(tzinfo=timezone.utc)
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    frames = []
+    while hour < end:
+        for key in store.list(hour_prefix(table, hour)):
+            frames.append(pd.read_parquet(io.BytesIO(store.get(key))))
+        hour += timedelta(hours=1)
+    if not frames:
+        return pd.DataFrame()
+    df = pd.concat(frames, ignore_index=True)
+    times = df[column].dt.tz_convert("UTC")
+    return df[(times >= start) & (times < end)].reset_index(drop=True)
+
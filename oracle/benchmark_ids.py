@@ -0,0 +1,130 @@
+import argparse
+import heapq
+import os
+import random
+import tracemalloc
+from time import perf_counter, time
+import ids
+from scheduler import RefreshScheduler
+
+# Compares TEXT fullnames with decoded BIGINT ids: memory held by the refresh scheduler, and
+# (with BENCH_DATABASE_URL) index size and UPDATE ... FROM (VALUES ...) lookup time.
+
+
+def make_names(n, seed=7):
+    rng = random.Random(seed)
+    start = int("l0000000", 36)
+    return [f"t{rng.choice('13')}_{ids.to_base36(start + i)}" for i in range(n)]
+
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = build()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size, kept
+
+
+def text_layout(names):
+    # The layout the scheduler had before: fullname -> list of fields, plus (due, fullname) heap entries.
+    now = time()
+    items, heap = {}, []
+    for name in names:
+        # A fresh copy, as the scheduler kept the string PRAW handed it alive.
+        name = name[:3] + name[3:]
+        due = now + random.random() * 3600
+        items[name] = [due, now, now + 86400, None, None, 0.0]
+        heapq.heappush(heap, (due, name))
+    return items, heap
+
+
+def packed_layout(names):
+    scheduler = RefreshScheduler()
+    now = time()
+    for name in names:
+        scheduler.add(name, now, now + 86400, due=now + random.random() * 3600)
+    # As after a save; the text layout above doesn't model the dirty set either.
+    scheduler.dirty.clear()
+    return scheduler
+
+
+def bench_memory(n):
+    names = make_names(n)
+    text, _ = measure(lambda: text_layout(names))
+    packed, _ = measure(lambda: packed_layout(names))
+    print(f"scheduler memory for {n} ids: text {text / n:.0f} B/id, packed {packed / n:.0f} B/id")
+
+
+def bench_database(url, n, batches):
+    import psycopg2
+    import psycopg2.extras
+
+    connection = psycopg2.connect(url)
+    connection.autocommit = True
+    schema = f"bench_ids_{os.getpid()}"
+    names = make_names(n)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+            cursor.execute(
+                """
+                CREATE TABLE text_ids (id TEXT, upvotes INTEGER, last_updated TIMESTAMP WITH TIME ZONE);
+                CREATE TABLE int_ids (id BIGINT, upvotes INTEGER, last_updated TIMESTAMP WITH TIME ZONE);
+                """
+            )
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO text_ids VALUES %s", [(x, 0, None) for x in names], page_size=10000
+            )
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO int_ids VALUES %s", [(ids.decode(x), 0, None) for x in names], page_size=10000
+            )
+            cursor.execute(
+                """
+                CREATE INDEX text_ids_index ON text_ids (id);
+                CREATE INDEX int_ids_index ON int_ids (id);
+                """
+            )
+            for table in ("text_ids", "int_ids"):
+                cursor.execute(f"VACUUM ANALYZE {table}")
+            for table in ("text_ids", "int_ids"):
+                cursor.execute(f"SELECT pg_relation_size('{table}'), pg_relation_size('{table}_index')")
+                table_size, index_size = cursor.fetchone()
+                print(f"{table}: table {table_size / 1e6:.1f} MB, index {index_size / 1e6:.1f} MB")
+            rng = random.Random(11)
+            for table, key in (("text_ids", lambda x: x), ("int_ids", ids.decode)):
+                elapsed = 0.0
+                for _ in range(batches):
+                    batch = [(key(x), rng.randint(0, 1000)) for x in rng.sample(names, 100)]
+                    start = perf_counter()
+                    psycopg2.extras.execute_values(
+                        cursor,
+                        f"""
+                        UPDATE {table} SET upvotes = v.upvotes, last_updated = now()
+                        FROM (VALUES %s) AS v (id, upvotes) WHERE {table}.id = v.id;
+                        """,
+                        batch,
+                        page_size=100,
+                    )
+                    elapsed += perf_counter() - start
+                print(f"{table}: {1000 * elapsed / batches:.2f}ms per 100-id UPDATE")
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ids", type=int, default=200000)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--batches", type=int, default=200)
+    args = parser.parse_args()
+    bench_memory(args.ids)
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if url:
+        bench_database(url, args.rows, args.batches)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import argparse
+import json
+import os
+import random
+from collections import defaultdict
+from time import perf_counter, time
+from benchmark_sentiment import make_corpus as make_texts
+from reddit_client import TokenBucket
+from reddit_streamer import RedditStreamer
+from spool import Spool, SpoolFlusher
+
+# Replays submissions and comments through RedditStreamer against fakes for PRAW, plus
+# fakeredis (or BENCH_REDIS_URL) and a throwaway schema in BENCH_DATABASE_URL. Without a
+# database the COPY payloads are still encoded, just not sent. With --spool rows are appended
+# to a spool in that directory instead and replayed into the database afterwards. fakeredis
+# is a dev dependency: pip install -r requirements-dev.txt.
+
+TABLES = """
+CREATE TABLE posts (
+    posted              TIMESTAMP WITH TIME ZONE,
+    last_updated        TIMESTAMP WITH TIME ZONE,
+    id                  BIGINT,
+    title               TEXT,
+    title_mentions      TEXT[],
+    text_mentions       TEXT[],
+    sentiment           DECIMAL,
+    upvotes             INTEGER,
+    comments            INTEGER
+);
+CREATE TABLE comments (
+    posted              TIMESTAMP WITH TIME ZONE,
+    last_updated        TIMESTAMP WITH TIME ZONE,
+    id                  BIGINT,
+    text                TEXT,
+    text_mentions       TEXT[],
+    sentiment           DECIMAL,
+    upvotes             INTEGER,
+    comments            INTEGER
+);
+CREATE TABLE updates (
+    posted              TIMESTAMP WITH TIME ZONE,
+    last_updated        TIMESTAMP WITH TIME ZONE,
+    id                  BIGINT,
+    kind                SMALLINT,
+    upvotes             INTEGER,
+    comments            INTEGER
+);
+CREATE TABLE mentions (
+    ticker              TEXT,
+    posted              TIMESTAMP WITH TIME ZONE,
+    item_id             BIGINT,
+    source              SMALLINT,
+    sentiment           DECIMAL
+);
+"""
+
+
+class Item:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def make_corpus(posts, comments, seed=7):
+    rng = random.Random(seed)
+    now = time()
+    titles = make_texts(posts, seed=seed)
+    bodies = make_texts(comments, seed=seed + 1)
+    submissions = [
+        Item(
+            name=f"t3_p{i}",
+            title=title,
+            selftext=rng.choice(bodies),
+            created_utc=now - rng.random() * 60,
+            ups=rng.randint(0, 50),
+            num_comments=0,
+            subreddit="wallstreetbets",
+        )
+        for i, title in enumerate(titles)
+    ]
+    items = []
+    for i, body in enumerate(bodies):
+        parent = rng.choice(items or submissions) if rng.random() < 0.5 else rng.choice(submissions)
+        items.append(
+            Item(
+                name=f"t1_c{i}",
+                body=body,
+                parent_id=parent.name,
+                created_utc=now - rng.random() * 60,
+                ups=rng.randint(0, 20),
+                subreddit="wallstreetbets",
+            )
+        )
+    return submissions, items
+
+
+def load_corpus(path):
+    submissions, items = [], []
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            kind = record.pop("kind")
+            record.setdefault("subreddit", "wallstreetbets")
+            (submissions if kind == "post" else items).append(Item(**record))
+    return submissions, items
+
+
+def fake_stream(items, chunk=100):
+    for i in range(0, len(items), chunk):
+        yield from items[i : i + chunk]
+        yield None
+    while True:
+        yield None
+
+
+class FakeStreams:
+    def __init__(self, submissions, comments):
+        self.posts = submissions
+        self.items = comments
+
+    def submissions(self, **kwargs):
+        return fake_stream(self.posts)
+
+    def comments(self, **kwargs):
+        return fake_stream(self.items)
+
+
+class FakeReddit:
+    def __init__(self, submissions, comments, seed=7):
+        self.rng = random.Random(seed)
+        self.stream = FakeStreams(submissions, comments)
+        self.items = {item.name: item for item in submissions + comments}
+
+    def subreddit(self, name):
+        return self
+
+    def new(self, limit=100):
+        return sorted(self.stream.posts, key=lambda x: -x.created_utc)[:limit]
+
+    def comments(self, limit=100):
+        return sorted(self.stream.items, key=lambda x: -x.created_utc)[:limit]
+
+    def info(self, fullnames):
+        found = []
+        for name in fullnames:
+            item = self.items.get(name)
+            if item is not None:
+                item.ups += self.rng.randint(0, 5)
+                found.append(item)
+        return found
+
+
+class NullCursor:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def copy_expert(self, sql, buf):
+        buf.read()
+
+
+class NullConnection:
+    def cursor(self):
+        return NullCursor()
+
+
+class StageTimer:
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def wrap(self, obj, method, stage):
+        original = getattr(obj, method)
+
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.totals[stage] += perf_counter() - start
+                self.calls[stage] += 1
+
+        setattr(obj, method, timed)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def make_redis():
+    url = os.environ.get("BENCH_REDIS_URL")
+    if url:
+        import redis
+
+        r = redis.StrictRedis.from_url(url, charset="utf-8", decode_responses=True)
+        r.flushdb()
+        return r
+    import fakeredis
+
+    return fakeredis.FakeStrictRedis(decode_responses=True)
+
+
+def make_connection():
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if not url:
+        return NullConnection(), None
+    import psycopg2
+
+    connection = psycopg2.connect(url)
+    connection.autocommit = True
+    schema = f"bench_ingest_{os.getpid()}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+        cursor.execute(TABLES)
+    return connection, schema
+
+
+def run(submissions, comments, refresh_rounds, spool_dir=None):
+    connection, schema = make_connection()
+    reddit = FakeReddit(submissions, comments)
+    spool = Spool(spool_dir) if spool_dir else None
+    streamer = RedditStreamer(r=make_redis(), connection=connection, reddit=reddit, spool=spool)
+    # Make every tracked id due straight away so refreshes are exercised.
+    streamer.jobs.min_interval = 0
+    streamer.jobs.age_factor = 0
+    # The fake has no rate limit, so don't let the token bucket pace refreshes.
+    streamer.info.buckets = [TokenBucket(rate=1e6, capacity=1e6)]
+    timer = StageTimer()
+    timer.wrap(streamer.matcher, "extract", "matching")
+    timer.wrap(streamer.sentiment, "score", "sentiment")
+    timer.wrap(streamer.sentiment, "score_batch", "sentiment")
+    timer.wrap(streamer.replies, "flush", "redis")
+    timer.wrap(streamer.replies, "counts", "redis")
+    timer.wrap(streamer.jobs, "save", "redis")
+    timer.wrap(streamer.writer, "flush", "db" if spool is None else "spool")
+    timer.wrap(streamer.recent, "add", "dedup")
+    timer.wrap(reddit, "info", "reddit.info")
+
+    latencies = []
+    ingested, refreshes = 0, 0
+    start = perf_counter()
+    while ingested < len(submissions) + len(comments) or refreshes < refresh_rounds:
+        for post in streamer.posts_stream:
+            if post is None:
+                break
+            item_start = perf_counter()
+            streamer.insert_post(post)
+            latencies.append(perf_counter() - item_start)
+            ingested += 1
+        for comment in streamer.comments_stream:
+            if comment is None:
+                break
+            item_start = perf_counter()
+            streamer.insert_comment(comment)
+            latencies.append(perf_counter() - item_start)
+            ingested += 1
+        streamer.score_comments()
+        if streamer.writer.due():
+            streamer.flush()
+        streamer.replies.maybe_flush()
+        streamer.jobs.maybe_save()
+        streamer.rotate_jobs()
+        if streamer.update_batch:
+            streamer.update_comments()
+            refreshes += 1
+        elif ingested >= len(submissions) + len(comments):
+            break
+    streamer.flush()
+    streamer.replies.flush()
+    elapsed = perf_counter() - start
+
+    if spool is not None and schema is not None:
+        import psycopg2
+
+        spooled = spool.pending_bytes()
+        flusher = SpoolFlusher(
+            spool,
+            lambda: psycopg2.connect(os.environ["BENCH_DATABASE_URL"], options=f"-c search_path={schema}"),
+            on_checkpoint=streamer.save_checkpoint,
+        )
+        replay_start = perf_counter()
+        flusher.start()
+        flusher.drain(600)
+        replay = perf_counter() - replay_start
+        print(f"replayed {flusher.rows} rows ({spooled / 1e6:.1f} MB) from the spool in {replay:.2f}s")
+
+    if schema is not None:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+
+    refreshed = streamer.t1 + streamer.t3
+    print(f"ingested {ingested} items, refreshed {refreshed} in {refreshes} batches, {elapsed:.2f}s")
+    print(f"items/sec: {(ingested + refreshed) / elapsed:.0f}")
+    print(
+        f"per-item latency p50: {percentile(latencies, 0.5) * 1000:.3f}ms, "
+        f"p99: {percentile(latencies, 0.99) * 1000:.3f}ms"
+    )
+    for stage, total in sorted(timer.totals.items(), key=lambda x: -x[1]):
+        print(f"  {stage}: {total:.3f}s ({100 * total / elapsed:.1f}%), {timer.calls[stage]} calls")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=500)
+    parser.add_argument("--comments", type=int, default=20000)
+    parser.add_argument("--refresh-rounds", type=int, default=20)
+    parser.add_argument("--corpus", help="JSON lines of recorded items with a 'kind' of post or comment")
+    parser.add_argument("--spool", help="directory to spool rows to instead of writing them straight to the database")
+    args = parser.parse_args()
+    if args.corpus:
+        submissions, comments = load_corpus(args.corpus)
+    else:
+        submissions, comments = make_corpus(args.posts, args.comments)
+    run(submissions, comments, args.refresh_rounds, args.spool)
+
+
+if __name__ == "__main__":
+    main()
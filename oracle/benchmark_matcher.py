@@ -0,0 +1,71 @@
+import os
+import random
+import subprocess
+import sys
+import tracemalloc
+from time import perf_counter, time
+
+WORDS = [
+    "the", "stock", "is", "going", "to", "moon", "buy", "calls", "puts", "on", "it", "all", "now",
+    "gme", "GME", "$GME", "AMC", "$amc", "TSLA", "$TSLA", "PLTR", "BB", "NOK", "$V", "$T", "$C",
+    "V", "T", "C", "$IT", "IT", "$ALL", "$NOW", "yolo", "DD", "$DD", "\U0001f680", "!", "GME's",
+    "(AAPL)", "MSFT,", "nio", "$NIO.", "sand", "a$gme", "gme5", "gme_", "SPY", "QQQ", "ARKK",
+]
+
+
+def make_corpus(n, seed=7):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 60))) for _ in range(n)]
+
+
+def measure(build):
+    tracemalloc.start()
+    start = perf_counter()
+    extract = build()
+    elapsed = perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return extract, elapsed, memory
+
+
+def build_flashtext():
+    from flashtext import KeywordProcessor
+    from tickers import NYSE, NASDAQ, AMEX
+
+    keyword_processor = KeywordProcessor()
+    keyword_processor.add_keywords_from_list(NYSE + NASDAQ + AMEX)
+    return lambda text: set(x.replace("$", "") for x in keyword_processor.extract_keywords(text))
+
+
+def build_matcher():
+    from ticker_matcher import TickerMatcher
+
+    matcher = TickerMatcher()
+    return lambda text: set(matcher.extract(text))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    corpus = make_corpus(n)
+    # Compile in a separate process so neither side gets tickers.py already imported.
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(__file__), "ticker_matcher.py")], check=True)
+    results = {}
+    for name, build in [("matcher", build_matcher), ("flashtext", build_flashtext)]:
+        extract, load_time, memory = measure(build)
+        start = time()
+        matches = [extract(text) for text in corpus]
+        elapsed = time() - start
+        results[name] = matches
+        print(f"{name}: load {load_time * 1000:.1f}ms, {memory / 1024:.0f} KiB, {n / elapsed:.0f} texts/sec")
+    differing = [
+        (text, a, b)
+        for text, a, b in zip(corpus, results["flashtext"], results["matcher"])
+        if a != b
+    ]
+    print(f"texts with different matches: {len(differing)}")
+    for text, a, b in differing[:5]:
+        print(f"  {text!r}: flashtext {sorted(a)}, matcher {sorted(b)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+import psycopg2
+import psycopg2.extras
+
+# "All mentions of a ticker in the last N hours" three ways against a throwaway schema in
+# BENCH_DATABASE_URL: UNNEST-style array scans of posts and comments, the same with GIN
+# indexes on the arrays, and a range scan of the normalized mentions table.
+
+QUERIES = {
+    "array scan": """
+        SELECT id, posted FROM comments WHERE posted >= %(since)s AND %(ticker)s = ANY(text_mentions)
+        UNION ALL
+        SELECT id, posted FROM posts
+        WHERE posted >= %(since)s AND (%(ticker)s = ANY(title_mentions) OR %(ticker)s = ANY(text_mentions));
+    """,
+    "gin": """
+        SELECT id, posted FROM comments WHERE posted >= %(since)s AND text_mentions @> ARRAY[%(ticker)s]
+        UNION ALL
+        SELECT id, posted FROM posts
+        WHERE posted >= %(since)s AND (title_mentions @> ARRAY[%(ticker)s] OR text_mentions @> ARRAY[%(ticker)s]);
+    """,
+    "mentions": """
+        SELECT item_id, posted FROM mentions WHERE ticker = %(ticker)s AND posted >= %(since)s;
+    """,
+}
+
+
+def populate(cursor, posts, comments, tickers, hours=72, seed=7):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    # A few tickers take most mentions, as on the real subreddit.
+    weights = [1.0 / (i + 1) for i in range(len(tickers))]
+
+    def pick():
+        if rng.random() < 0.6:
+            return []
+        return sorted(set(rng.choices(tickers, weights, k=rng.randint(1, 3))))
+
+    def posted():
+        return now - timedelta(seconds=rng.random() * hours * 3600)
+
+    post_rows = [(i, posted(), pick(), pick(), rng.random()) for i in range(posts)]
+    comment_rows = [(i, posted(), pick(), rng.random()) for i in range(comments)]
+    cursor.execute(
+        """
+        CREATE TABLE posts (
+            id BIGINT, posted TIMESTAMP WITH TIME ZONE, title_mentions TEXT[], text_mentions TEXT[], sentiment DECIMAL
+        );
+        CREATE TABLE comments (id BIGINT, posted TIMESTAMP WITH TIME ZONE, text_mentions TEXT[], sentiment DECIMAL);
+        CREATE TABLE mentions (
+            ticker TEXT, posted TIMESTAMP WITH TIME ZONE, item_id BIGINT, source SMALLINT, sentiment DECIMAL
+        );
+        """
+    )
+    psycopg2.extras.execute_values(cursor, "INSERT INTO posts VALUES %s", post_rows, page_size=10000)
+    psycopg2.extras.execute_values(cursor, "INSERT INTO comments VALUES %s", comment_rows, page_size=10000)
+    cursor.execute(
+        """
+        INSERT INTO mentions SELECT ticker, posted, id, 1, sentiment FROM comments, UNNEST(text_mentions) AS ticker;
+        INSERT INTO mentions SELECT ticker, posted, id, 2, sentiment FROM posts, UNNEST(title_mentions) AS ticker;
+        INSERT INTO mentions SELECT ticker, posted, id, 3, sentiment FROM posts, UNNEST(text_mentions) AS ticker;
+        CREATE INDEX ON posts (posted);
+        CREATE INDEX ON comments (posted);
+        CREATE INDEX ON mentions (ticker, posted) INCLUDE (item_id, source, sentiment);
+        """
+    )
+
+
+def run(cursor, ticker, since, reps):
+    params = {"ticker": ticker, "since": since}
+    for name, sql in QUERIES.items():
+        if name == "gin":
+            cursor.execute(
+                """
+                CREATE INDEX IF NOT EXISTS comments_text_gin ON comments USING GIN (text_mentions);
+                CREATE INDEX IF NOT EXISTS posts_title_gin ON posts USING GIN (title_mentions);
+                CREATE INDEX IF NOT EXISTS posts_text_gin ON posts USING GIN (text_mentions);
+                ANALYZE posts;
+                ANALYZE comments;
+                """
+            )
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0][0]["Plan"]
+        nodes = []
+        stack = [plan]
+        while stack:
+            node = stack.pop()
+            if "Relation Name" in node:
+                nodes.append(f"{node['Node Type']} on {node['Relation Name']}")
+            stack.extend(node.get("Plans", []))
+        start = perf_counter()
+        for _ in range(reps):
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+        elapsed = (perf_counter() - start) / reps
+        print(f"{name}: {1000 * elapsed:.2f}ms, {len(rows)} rows ({'; '.join(sorted(set(nodes)))})")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=50000)
+    parser.add_argument("--comments", type=int, default=2000000)
+    parser.add_argument("--ticker", default="GME")
+    parser.add_argument("--hours", type=int, default=6)
+    parser.add_argument("--reps", type=int, default=20)
+    args = parser.parse_args()
+    tickers = [args.ticker] + [f"T{i}" for i in range(2000)]
+    connection = psycopg2.connect(os.environ["BENCH_DATABASE_URL"])
+    connection.autocommit = True
+    schema = f"bench_mentions_{os.getpid()}"
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE SCHEMA {schema}; SET search_path TO {schema};")
+        try:
+            populate(cursor, args.posts, args.comments, tickers)
+            for table in ("posts", "comments", "mentions"):
+                cursor.execute(f"VACUUM ANALYZE {table}")
+            run(cursor, args.ticker, datetime.now(timezone.utc) - timedelta(hours=args.hours), args.reps)
+        finally:
+            cursor.execute(f"DROP SCHEMA {schema} CASCADE;")
+
+
+if __name__ == "__main__":
+    main()
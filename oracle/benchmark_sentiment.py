@@ -0,0 +1,57 @@
+import random
+import sys
+from time import time
+from sentiment import TOLERANCE, LexiconSentiment, TextBlobSentiment
+
+WORDS = [
+    "GME", "AMC", "calls", "puts", "moon", "tendies", "this", "is", "the", "way", "not", "never",
+    "very", "really", "good", "bad", "great", "terrible", "best", "worst", "bullish", "bearish",
+    "happy", "sad", "stupid", "smart", "crazy", "insane", "free", "money", "hold", "buy", "sell",
+    "don't", "isn't", "absolutely", "amazing", "awful", "!", "?", ":)", ":(", ":D", "<3", "(!)",
+    "\U0001f680", "\U0001f48e", "\U0001f64c", "...", "$TSLA", "to", "a", "of", "retarded", "ape",
+]
+COPYPASTA = [
+    "\U0001f680\U0001f680\U0001f680",
+    "this",
+    "This is the way",
+    "Sir, this is a Wendy's",
+    "I like the stock",
+    "Apes together strong \U0001f98d\U0001f48e\U0001f64c",
+]
+
+
+def make_corpus(n, repeat_share=0.2, seed=7):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(n):
+        if rng.random() < repeat_share:
+            corpus.append(rng.choice(COPYPASTA))
+        else:
+            corpus.append(" ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 40))))
+    return corpus
+
+
+def run(scorer, corpus, batch_size):
+    start = time()
+    scores = []
+    for i in range(0, len(corpus), batch_size):
+        scores.extend(scorer.score_batch(corpus[i : i + batch_size]))
+    return scores, time() - start
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    corpus = make_corpus(n)
+    baseline, baseline_time = run(TextBlobSentiment(), corpus, 100)
+    lexicon = LexiconSentiment()
+    scores, lexicon_time = run(lexicon, corpus, 100)
+    max_diff = max(abs(a - b) for a, b in zip(baseline, scores))
+    print(f"TextBlob: {n / baseline_time:.0f} items/sec")
+    print(f"Lexicon:  {n / lexicon_time:.0f} items/sec ({baseline_time / lexicon_time:.1f}x)")
+    print(f"cache hits: {lexicon.hits}, misses: {lexicon.misses}")
+    print(f"max polarity difference: {max_diff} (tolerance {TOLERANCE})")
+    assert max_diff <= TOLERANCE
+
+
+if __name__ == "__main__":
+    main()
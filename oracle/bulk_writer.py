@@ -0,0 +1,102 @@
+import io
+from datetime import datetime
+from time import time
+
+COLUMNS = {
+    "posts": [
+        "posted", "last_updated", "id", "title", "title_mentions", "text_mentions",
+        "sentiment", "upvotes", "comments",
+    ],
+    "comments": [
+        "posted", "last_updated", "id", "text", "text_mentions", "sentiment", "upvotes", "comments",
+    ],
+    "updates": ["posted", "last_updated", "id", "kind", "upvotes", "comments"],
+    "mentions": ["ticker", "posted", "item_id", "source", "sentiment"],
+}
+
+COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def encode_array(values):
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        else:
+            items.append('"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def encode_value(value):
+    if value is None:
+        return "\\N"
+    if isinstance(value, datetime):
+        text = value.isoformat()
+    elif isinstance(value, (list, tuple)):
+        text = encode_array(value)
+    else:
+        text = str(value)
+    return text.translate(COPY_ESCAPES)
+
+
+def encode_rows(columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write("\t".join(encode_value(row[column]) for column in columns))
+        buf.write("\n")
+    return buf.getvalue()
+
+
+def copy_rows(cursor, table, columns, data):
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", io.StringIO(data))
+
+
+class BulkWriter:
+    # With a spool, flush appends the COPY text there and a SpoolFlusher loads it into Postgres.
+    def __init__(self, connection=None, max_rows=500, max_age=2.0, spool=None):
+        self.connection = connection
+        self.spool = spool
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.buffers = {table: [] for table in COLUMNS}
+        self.pending = 0
+        self.oldest = None
+        self.rows_written = 0
+
+    def add(self, table, row):
+        self.buffers[table].append(row)
+        self.pending += 1
+        if self.oldest is None:
+            self.oldest = time()
+        self.maybe_flush()
+
+    def add_many(self, table, rows):
+        for row in rows:
+            self.add(table, row)
+
+    def due(self):
+        if self.pending == 0:
+            return False
+        return self.pending >= self.max_rows or time() - self.oldest >= self.max_age
+
+    def maybe_flush(self):
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        if self.spool is not None:
+            for table, rows in self.buffers.items():
+                if rows:
+                    self.spool.append(table, COLUMNS[table], encode_rows(COLUMNS[table], rows))
+                    self.rows_written += len(rows)
+                    self.buffers[table] = []
+            self.spool.sync()
+        else:
+            with self.connection.cursor() as cursor:
+                for table, rows in self.buffers.items():
+                    if rows:
+                        copy_rows(cursor, table, COLUMNS[table], encode_rows(COLUMNS[table], rows))
+                        self.rows_written += len(rows)
+                        self.buffers[table] = []
+        self.pending = 0
+        self.oldest = None
@@ -0,0 +1,202 @@
+import hashlib
+import math
+import threading
+from time import time
+from redis.exceptions import RedisError
+
+
+def fingerprint(name):
+    # Hashed once per lookup and shared by every filter it's checked against.
+    digest = hashlib.blake2b(name.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        h1, h2 = key
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self.positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        # Stops at the first clear bit, which for a new id is usually the first one.
+        h1, h2 = key
+        for i in range(self.hashes):
+            pos = (h1 + i * h2) % self.size
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class RecentIds:
+    # Ids ingested in the last `window` hours, kept in hourly Redis sets ("seen:<hour>") that
+    # expire on their own. Local bloom filters, one per hour like the sets, answer most
+    # lookups; only their positives (real duplicates plus ~0.1% false positives over the
+    # whole window) are confirmed against Redis. A new hour's filter is sized for twice the
+    # busiest hour seen, so a filter never fills up past its error rate as volume grows.
+    def __init__(self, r, window=24, capacity=50000, error_rate=0.00004):
+        self.r = r
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        # name -> hour bucket, for ids not yet persisted; taken ids stay in `storing` until stored
+        self.pending = {}
+        self.storing = {}
+        self.duplicates = 0
+        self.errors = 0
+        self.load()
+
+    def bucket(self, hour):
+        return f"seen:{hour}"
+
+    def hours(self, now=None):
+        hour = int((now or time()) // 3600)
+        return range(hour - self.window, hour + 1)
+
+    def buckets(self, now=None):
+        return [self.bucket(h) for h in self.hours(now)]
+
+    def load(self):
+        blooms = {}
+        for hour in self.hours():
+            names = list(self.r.sscan_iter(self.bucket(hour), count=1000))
+            bloom = blooms[hour] = BloomFilter(max(self.capacity, 2 * len(names)), self.error_rate)
+            for name in names:
+                bloom.add(fingerprint(name))
+        with self.lock:
+            for name, hour in list(self.pending.items()) + list(self.storing.items()):
+                if hour in blooms:
+                    blooms[hour].add(fingerprint(name))
+            self.blooms = blooms
+
+    def bloom(self, hour):
+        # The filter for `hour`, created as the hour starts; hours out of the window are dropped.
+        if hour not in self.blooms:
+            busiest = max(bloom.count for bloom in self.blooms.values())
+            self.blooms[hour] = BloomFilter(max(self.capacity, 2 * busiest), self.error_rate)
+            for old in [h for h in self.blooms if h < hour - self.window]:
+                del self.blooms[old]
+        return self.blooms[hour]
+
+    def stored(self, name):
+        pipe = self.r.pipeline(transaction=False)
+        for key in self.buckets():
+            pipe.sismember(key, name)
+        try:
+            return any(pipe.execute())
+        except RedisError:
+            # Unconfirmed, the id is taken as new: a duplicate row beats a dropped item.
+            self.errors += 1
+            return False
+
+    def add(self, name):
+        # Returns False if the id was already ingested.
+        with self.lock:
+            if name in self.pending or name in self.storing:
+                self.duplicates += 1
+                return False
+            key = fingerprint(name)
+            maybe_seen = any(key in bloom for bloom in self.blooms.values() if bloom.count)
+        if maybe_seen and self.stored(name):
+            with self.lock:
+                self.duplicates += 1
+            return False
+        hour = int(time() // 3600)
+        with self.lock:
+            self.bloom(hour).add(key)
+            self.pending[name] = hour
+        return True
+
+    def take(self):
+        with self.lock:
+            taken = self.pending
+            self.storing.update(taken)
+            self.pending = {}
+        return taken
+
+    def store(self, taken):
+        if not taken:
+            return
+        by_hour = {}
+        for name, hour in taken.items():
+            by_hour.setdefault(hour, []).append(name)
+        ttl = (self.window + 1) * 3600
+        pipe = self.r.pipeline(transaction=False)
+        for hour, names in by_hour.items():
+            pipe.sadd(self.bucket(hour), *names)
+            pipe.expire(self.bucket(hour), ttl)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            # Back into pending, to be stored with the next checkpoint.
+            with self.lock:
+                for name, hour in taken.items():
+                    self.storing.pop(name, None)
+                    self.pending.setdefault(name, hour)
+            self.errors += 1
+            print(f"Storing ingested ids failed, will retry: {e}")
+            return
+        with self.lock:
+            for name in taken:
+                self.storing.pop(name, None)
+
+
+class Checkpoints:
+    # Newest created_utc ingested per (kind, subreddit), so a restart can backfill from listings.
+    def __init__(self, r, key="stream_checkpoints"):
+        self.r = r
+        self.key = key
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.dirty = set()
+        self.errors = 0
+        self.load()
+
+    def load(self):
+        # Other workers may have moved a checkpoint on since this one last read it.
+        stored = self.r.hgetall(self.key)
+        with self.lock:
+            for field, value in stored.items():
+                if float(value) > self.latest.get(field, 0.0):
+                    self.latest[field] = float(value)
+
+    def field(self, kind, subreddit):
+        return f"{kind}:{subreddit.lower()}"
+
+    def get(self, kind, subreddit):
+        return self.latest.get(self.field(kind, subreddit))
+
+    def record(self, kind, subreddit, created):
+        field = self.field(kind, subreddit)
+        with self.lock:
+            if created > self.latest.get(field, 0.0):
+                self.latest[field] = created
+                self.dirty.add(field)
+
+    def take(self):
+        with self.lock:
+            taken = {field: self.latest[field] for field in self.dirty}
+            self.dirty = set()
+        return taken
+
+    def store(self, taken):
+        if taken:
+            try:
+                self.r.hset(self.key, mapping=taken)
+            except RedisError as e:
+                # latest still holds these (or newer) values, so marking them dirty retries them.
+                with self.lock:
+                    self.dirty.update(taken)
+                self.errors += 1
+                print(f"Storing stream checkpoints failed, will retry: {e}")
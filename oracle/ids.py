@@ -0,0 +1,37 @@
+import string
+
+# Reddit ids are base36 strings behind a kind prefix ("t1_" comment, "t3_" submission).
+# In Postgres they are stored as the decoded BIGINT plus, where a table mixes kinds, a
+# SMALLINT kind; in memory as one int with the kind in the low bit.
+KINDS = {"t1": 1, "t3": 3}
+DIGITS = string.digits + string.ascii_lowercase
+
+
+def decode(fullname):
+    return int(fullname[3:], 36)
+
+
+def kind_of(fullname):
+    return KINDS[fullname[:2]]
+
+
+def to_base36(value):
+    if value == 0:
+        return "0"
+    digits = []
+    while value:
+        value, digit = divmod(value, 36)
+        digits.append(DIGITS[digit])
+    return "".join(reversed(digits))
+
+
+def fullname(kind, value):
+    return f"t{kind}_{to_base36(value)}"
+
+
+def pack(name):
+    return int(name[3:], 36) << 1 | (name[1] == "3")
+
+
+def unpack(packed):
+    return f"t{3 if packed & 1 else 1}_{to_base36(packed >> 1)}"
@@ -0,0 +1,289 @@
+import os
+import sys
+import threading
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help, fn, labels=None):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.fn = fn
+
+    def samples(self):
+        return [(self.name, self.labels, self.fn())]
+
+
+class FunctionCounter(Gauge):
+    kind = "counter"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=None, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels or {}
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start)
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            samples.append((self.name + "_bucket", {**self.labels, "le": le}, cumulative))
+        samples.append((self.name + "_sum", self.labels, total))
+        samples.append((self.name + "_count", self.labels, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.metrics:
+                self.metrics[key] = cls(name, help, *args, labels=labels)
+            return self.metrics[key]
+
+    def counter(self, name, help, **labels):
+        return self.get(Counter, name, help, labels)
+
+    def histogram(self, name, help, **labels):
+        return self.get(Histogram, name, help, labels)
+
+    def gauge(self, name, help, fn, **labels):
+        return self.get(Gauge, name, help, labels, fn)
+
+    def function_counter(self, name, help, fn, **labels):
+        return self.get(FunctionCounter, name, help, labels, fn)
+
+    def exposition(self):
+        lines = []
+        seen = set()
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda m: m.name)
+        for metric in metrics:
+            if metric.name not in seen:
+                seen.add(metric.name)
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class SamplingProfiler(threading.Thread):
+    # Samples every other thread's stack and keeps collapsed-stack counts ("a;b;c N"),
+    # which flamegraph tools read directly.
+    def __init__(self, interval=0.01):
+        super().__init__(name="profiler", daemon=True)
+        self.interval = interval
+        self.stacks = Tally()
+        self.lock = threading.Lock()
+
+    def run(self):
+        me = threading.get_ident()
+        names = {}
+        while True:
+            sleep(self.interval)
+            frames = sys._current_frames()
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            with self.lock:
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def instrument(obj, method, histogram):
+    original = getattr(obj, method)
+
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            histogram.observe(perf_counter() - start)
+
+    setattr(obj, method, timed)
+
+
+def timed_stream(stream, histogram):
+    while True:
+        start = perf_counter()
+        try:
+            item = next(stream)
+        except StopIteration:
+            return
+        histogram.observe(perf_counter() - start)
+        yield item
+
+
+def instrument_streamer(streamer, registry=REGISTRY):
+    def stage(name):
+        return registry.histogram("oracle_stage_seconds", "Time spent per call in each ingest stage.", stage=name)
+
+    writer = streamer.writer
+    open_streams = streamer.open_streams
+
+    def timed_streams():
+        # rebalance reopens the streams whenever shards move, so they're wrapped again each time.
+        open_streams()
+        streamer.posts_stream = timed_stream(streamer.posts_stream, stage("poll_posts"))
+        streamer.comments_stream = timed_stream(streamer.comments_stream, stage("poll_comments"))
+
+    streamer.posts_stream = timed_stream(streamer.posts_stream, stage("poll_posts"))
+    streamer.comments_stream = timed_stream(streamer.comments_stream, stage("poll_comments"))
+    streamer.open_streams = timed_streams
+    instrument(streamer, "insert_post", stage("insert_post"))
+    instrument(streamer, "insert_comment", stage("insert_comment"))
+    instrument(streamer.matcher, "extract", stage("keywords"))
+    instrument(streamer.sentiment, "score", stage("sentiment"))
+    instrument(streamer.sentiment, "score_batch", stage("sentiment_batch"))
+    instrument(streamer.replies, "flush", stage("redis_flush"))
+    instrument(streamer.replies, "counts", stage("redis_counts"))
+    instrument(streamer.jobs, "save", stage("redis_schedule_save"))
+    instrument(writer, "flush", stage("postgres_copy" if streamer.spool is None else "spool_append"))
+    instrument(streamer, "fetch_updates", stage("reddit_info"))
+    instrument(streamer.spikes, "check", stage("spike_check"))
+    registry.gauge("oracle_jobs", "Ids tracked for refresh.", lambda: len(streamer.jobs))
+    registry.gauge("oracle_pending_comments", "Comments waiting for batch sentiment.", lambda: len(streamer.comments))
+    registry.gauge("oracle_pending_rows", "Rows buffered for COPY.", lambda: writer.pending)
+    registry.gauge("oracle_pending_redis_keys", "Reply counts and registrations not yet flushed.", streamer.replies.pending)
+    registry.gauge("oracle_update_batch", "Ids waiting in the current refresh batch.", lambda: len(streamer.update_batch))
+    registry.function_counter("oracle_refreshed_total", "Items refreshed through reddit.info.", lambda: streamer.t1, kind="t1")
+    registry.function_counter("oracle_refreshed_total", "Items refreshed through reddit.info.", lambda: streamer.t3, kind="t3")
+    registry.function_counter("oracle_duplicates_dropped_total", "Items dropped as already ingested.", lambda: streamer.recent.duplicates)
+    registry.function_counter("oracle_reddit_requests_total", "reddit.info requests made.", lambda: streamer.info.requests)
+    registry.function_counter("oracle_reddit_errors_total", "reddit.info requests that failed and were retried.", lambda: streamer.info.errors)
+    registry.function_counter("oracle_spike_alerts_total", "Ticker spike alerts emitted.", lambda: streamer.spikes.alerts)
+    registry.gauge("oracle_spike_tickers", "Tickers tracked by the spike detector.", lambda: len(streamer.spikes.tickers))
+    registry.function_counter(
+        "oracle_redis_errors_total",
+        "Redis calls on the ingest path that failed and were retried later or skipped.",
+        lambda: streamer.replies.errors + streamer.recent.errors + streamer.checkpoints.errors + streamer.jobs.errors,
+    )
+    registry.function_counter("oracle_redis_round_trips_total", "Redis round-trips made by the reply counter.", lambda: streamer.replies.round_trips)
+    if streamer.spool is not None:
+        spool = streamer.spool
+        registry.gauge("oracle_spool_bytes", "Spooled bytes not yet replayed into Postgres.", spool.pending_bytes)
+        registry.gauge("oracle_spool_lag_seconds", "Age of the oldest spooled record not yet replayed.", spool.lag)
+        registry.gauge("oracle_spool_segments", "Spool segment files on disk.", lambda: len(spool.maps))
+    if streamer.flusher is not None:
+        flusher = streamer.flusher
+        instrument(flusher, "copy", stage("postgres_replay"))
+        registry.function_counter("oracle_spool_replayed_rows_total", "Rows replayed from the spool into Postgres.", lambda: flusher.rows)
+        registry.function_counter("oracle_spool_errors_total", "Failed spool replays.", lambda: flusher.errors)
+        registry.function_counter("oracle_spool_rejected_rows_total", "Spooled rows Postgres refused, set aside.", lambda: flusher.rejected)
+
+
+def serve(port, profiler=None, registry=REGISTRY, host="127.0.0.1"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.exposition()
+                content_type = "text/plain; version=0.0.4"
+            elif self.path == "/profile" and profiler is not None:
+                body = profiler.collapsed()
+                content_type = "text/plain"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def start_from_env(streamer):
+    port = os.environ.get("METRICS_PORT")
+    if not port:
+        return None
+    instrument_streamer(streamer)
+    profiler = None
+    if os.environ.get("METRICS_PROFILE"):
+        profiler = SamplingProfiler(float(os.environ["METRICS_PROFILE"]))
+        profiler.start()
+    return serve(int(port), profiler)
@@ -1,5 +1,6 @@
 import psycopg2
 import os
+from partitions import PARTITIONED_TABLES, is_partitioned, partition_table, retention_cutoff
 
 DATABASE_URL = os.environ['DATABASE_URL']
 
@@ -132,5 +133,92 @@ def create_staging_table4(cursor) -> None:
     );
     """)
 
+def add_rollup_watermarks(cursor) -> None:
+    cursor.execute("""
+    ALTER TABLE posts ADD COLUMN IF NOT EXISTS ingested TIMESTAMP WITH TIME ZONE DEFAULT now();
+    ALTER TABLE comments ADD COLUMN IF NOT EXISTS ingested TIMESTAMP WITH TIME ZONE DEFAULT now();
+    CREATE INDEX IF NOT EXISTS posts_ingested_index ON posts (ingested);
+    CREATE INDEX IF NOT EXISTS comments_ingested_index ON comments (ingested);
+    CREATE INDEX IF NOT EXISTS posts_last_updated_index ON posts (last_updated);
+    CREATE INDEX IF NOT EXISTS comments_last_updated_index ON comments (last_updated);
+    CREATE INDEX IF NOT EXISTS updates_last_updated_index ON updates (last_updated);
+    CREATE TABLE IF NOT EXISTS rollup_watermarks (
+        name                TEXT PRIMARY KEY,
+        watermark           TIMESTAMP WITH TIME ZONE
+    );
+    """)
+
+def partition_by_posted(cursor) -> None:
+    for table in PARTITIONED_TABLES:
+        cursor.execute("SELECT to_regclass(%s)", [table])
+        if cursor.fetchone()[0] is not None and not is_partitioned(cursor, table):
+            partition_table(cursor, table, retention_cutoff())
+
+def add_refresh_candidate_indexes(cursor) -> None:
+    # Partial indexes whose predicates match RedditUpdater.pull_ids, so it reads the
+    # oldest-refreshed rows with mentions straight off the index.
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS comments_refresh_candidates_index ON comments (last_updated)
+    WHERE cardinality(text_mentions) > 0;
+    CREATE INDEX IF NOT EXISTS posts_refresh_candidates_index ON posts (last_updated)
+    WHERE cardinality(text_mentions) > 0 OR cardinality(title_mentions) > 0;
+    """)
+
+def add_ticker_leaderboards(cursor) -> None:
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ticker_leaderboards (
+        metric              TEXT,
+        window_hours        INTEGER,
+        position            INTEGER,
+        ticker              TEXT,
+        value               BIGINT,
+        PRIMARY KEY (metric, window_hours, position)
+    );
+    CREATE INDEX IF NOT EXISTS tickers_ticker_date_index ON tickers (ticker, date);
+    """)
+
+def compact_ids(cursor) -> None:
+    # TEXT fullnames -> decoded base36 BIGINT (see ids.py); updates mixes comments and posts,
+    # so it also keeps the kind (1 or 3). ALTER ... TYPE rewrites each table once.
+    cursor.execute("""
+    CREATE OR REPLACE FUNCTION base36_decode(value TEXT) RETURNS BIGINT AS $$
+        SELECT COALESCE(SUM(
+            (strpos('0123456789abcdefghijklmnopqrstuvwxyz', substr(lower(value), i, 1)) - 1)
+            * power(36::NUMERIC, length(value) - i)
+        ), 0)::BIGINT
+        FROM generate_series(1, length(value)) AS i;
+    $$ LANGUAGE SQL IMMUTABLE STRICT;
+    ALTER TABLE updates ADD COLUMN IF NOT EXISTS kind SMALLINT;
+    UPDATE updates SET kind = substr(id, 2, 1)::SMALLINT WHERE kind IS NULL;
+    ALTER TABLE posts ALTER COLUMN id TYPE BIGINT USING base36_decode(split_part(id, '_', 2));
+    ALTER TABLE comments ALTER COLUMN id TYPE BIGINT USING base36_decode(split_part(id, '_', 2));
+    ALTER TABLE updates ALTER COLUMN id TYPE BIGINT USING base36_decode(split_part(id, '_', 2));
+    CREATE INDEX IF NOT EXISTS posts_id_index ON posts (id);
+    CREATE INDEX IF NOT EXISTS comments_id_index ON comments (id);
+    """)
+
+def add_mentions(cursor) -> None:
+    # One row per (item, ticker) so per-ticker questions are index range scans instead of
+    # UNNESTing posts and comments. source: 1 comment text, 2 post title, 3 post text.
+    cursor.execute("SELECT to_regclass('mentions')")
+    if cursor.fetchone()[0] is not None:
+        return
+    cursor.execute("""
+    CREATE TABLE mentions (
+        ticker              TEXT,
+        posted              TIMESTAMP WITH TIME ZONE,
+        item_id             BIGINT,
+        source              SMALLINT,
+        sentiment           DECIMAL
+    );
+    INSERT INTO mentions SELECT ticker, posted, id, 1, sentiment FROM comments, UNNEST(text_mentions) AS ticker;
+    INSERT INTO mentions SELECT ticker, posted, id, 2, sentiment FROM posts, UNNEST(title_mentions) AS ticker;
+    INSERT INTO mentions SELECT ticker, posted, id, 3, sentiment FROM posts, UNNEST(text_mentions) AS ticker;
+    CREATE INDEX mentions_ticker_posted_index ON mentions (ticker, posted) INCLUDE (item_id, source, sentiment);
+    CREATE INDEX mentions_posted_index ON mentions (posted);
+    """)
+    if is_partitioned(cursor, "posts"):
+        partition_table(cursor, "mentions", retention_cutoff())
+
 with connection.cursor() as cursor:
-    create_staging_table4(cursor)
+    add_mentions(cursor)
@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+
+PARTITIONED_TABLES = ["posts", "comments", "updates", "mentions"]
+
+
+def partition_name(table, day):
+    return f"{table}_{day:%Y%m%d}"
+
+
+def day_bound(day):
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+def is_partitioned(cursor, table):
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)",
+        [table],
+    )
+    return cursor.fetchone() is not None
+
+
+def create_partitions(cursor, table, first_day, last_day):
+    existing = set(list_partitions(cursor, table))
+    day = first_day
+    while day <= last_day:
+        name = partition_name(table, day)
+        if name not in existing:
+            # If the updater skipped days, their rows are in the default partition and PARTITION OF
+            # would fail; they're moved into the new table before it's attached, in one transaction.
+            cursor.execute(
+                f"""
+                CREATE TABLE {name} (LIKE {table} INCLUDING ALL);
+                WITH moved AS (
+                    DELETE FROM {table}_default WHERE posted >= %(start)s AND posted < %(end)s RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved;
+                ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%(start)s) TO (%(end)s);
+                """,
+                {"start": day_bound(day), "end": day_bound(day + timedelta(days=1))},
+            )
+        day += timedelta(days=1)
+
+
+def list_partitions(cursor, table):
+    cursor.execute(
+        """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s);
+        """,
+        [table],
+    )
+    return [x[0] for x in cursor.fetchall()]
+
+
+def drop_expired_partitions(cursor, table, cutoff):
+    # A daily partition goes once its whole range is older than cutoff; the few hours of rows
+    # past the boundary simply wait for the next run.
+    dropped = []
+    for name in list_partitions(cursor, table):
+        suffix = name[len(table) + 1 :]
+        if not suffix.isdigit():
+            continue
+        day = datetime.strptime(suffix, "%Y%m%d").date()
+        if day_bound(day + timedelta(days=1)) <= cutoff:
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}; DROP TABLE {name};")
+            dropped.append(name)
+    cursor.execute(f"DELETE FROM {table}_default WHERE posted < %s", [cutoff])
+    return dropped
+
+
+def maintain_partitions(cursor, cutoff, days_ahead=3):
+    today = datetime.now(timezone.utc).date()
+    for table in PARTITIONED_TABLES:
+        create_partitions(cursor, table, today, today + timedelta(days=days_ahead))
+        drop_expired_partitions(cursor, table, cutoff)
+
+
+def partition_table(cursor, table, cutoff, days_ahead=3):
+    # Swaps an unpartitioned table for a partitioned copy in one statement batch (one implicit
+    # transaction), keeping only rows inside the retention window.
+    cursor.execute(f"SELECT min(posted) FROM {table} WHERE posted >= %s", [cutoff])
+    oldest = cursor.fetchone()[0]
+    today = datetime.now(timezone.utc).date()
+    first_day = oldest.astimezone(timezone.utc).date() if oldest is not None else today
+    statements = [
+        f"ALTER TABLE {table} RENAME TO {table}_unpartitioned;",
+        f"CREATE TABLE {table} (LIKE {table}_unpartitioned INCLUDING ALL) PARTITION BY RANGE (posted);",
+        f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT;",
+    ]
+    params = []
+    day = first_day
+    while day <= today + timedelta(days=days_ahead):
+        statements.append(
+            f"CREATE TABLE {partition_name(table, day)} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s);"
+        )
+        params += [day_bound(day), day_bound(day + timedelta(days=1))]
+        day += timedelta(days=1)
+    statements += [
+        f"INSERT INTO {table} SELECT * FROM {table}_unpartitioned WHERE posted >= %s;",
+        f"DROP TABLE {table}_unpartitioned;",
+    ]
+    cursor.execute("\n".join(statements), params + [cutoff])
+
+
+def retention_cutoff(hours=72):
+    return datetime.now(timezone.utc) - timedelta(hours=hours)
+
@@ -0,0 +1,219 @@
+import threading
+from queue import Empty, Queue
+from time import time, sleep
+
+
+class Stage(threading.Thread):
+    def __init__(self, name, inbox=None, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.inbox = inbox
+        self.outbox = outbox
+        self.processed = 0
+        self.blocked = 0.0
+        self.error = None
+        # Set by drain; the stage sets finished once it has nothing left to pass on.
+        self.draining = False
+        self.finished = False
+
+    def emit(self, item):
+        start = time()
+        self.outbox.put(item)
+        self.blocked += time() - start
+
+    def run(self):
+        try:
+            while not self.finished:
+                self.step()
+        except Exception as e:
+            self.error = e
+            raise
+
+    def step(self):
+        raise NotImplementedError
+
+    def drain(self):
+        self.draining = True
+        self.join()
+
+
+class QueueWriter:
+    # Stands in for BulkWriter inside stages that produce rows; the real writer lives in WriterStage.
+    def __init__(self, stage):
+        self.stage = stage
+
+    def add(self, table, row):
+        self.stage.emit((table, [row]))
+
+    def add_many(self, table, rows):
+        rows = list(rows)
+        if rows:
+            self.stage.emit((table, rows))
+
+    def maybe_flush(self):
+        pass
+
+
+class StreamReader(Stage):
+    def __init__(self, streamer, outbox, idle_sleep=1.0):
+        super().__init__("reader", outbox=outbox)
+        self.streamer = streamer
+        self.idle_sleep = idle_sleep
+
+    def step(self):
+        if self.draining:
+            self.finished = True
+            return
+        found = 0
+        for post in self.streamer.posts_stream:
+            if post is None:
+                break
+            found += 1
+            self.emit(("post", post))
+        for comment in self.streamer.comments_stream:
+            if comment is None:
+                break
+            found += 1
+            self.emit(("comment", comment))
+        self.processed += found
+        if found == 0:
+            sleep(self.idle_sleep)
+
+
+class Enricher(Stage):
+    def __init__(self, streamer, inbox, outbox, checkpoint_every=2.0):
+        super().__init__("enricher", inbox=inbox, outbox=outbox)
+        self.streamer = streamer
+        self.checkpoint_every = checkpoint_every
+        self.last_checkpoint = time()
+
+    def maybe_checkpoint(self):
+        # Queued behind the rows it covers, so the writer stores it only after they're flushed.
+        if time() - self.last_checkpoint >= self.checkpoint_every:
+            self.streamer.score_comments()
+            self.emit(("checkpoint", self.streamer.checkpoint()))
+            self.last_checkpoint = time()
+
+    def step(self):
+        try:
+            kind, item = self.inbox.get(timeout=0.5)
+        except Empty:
+            self.streamer.score_comments()
+            if self.draining:
+                self.emit(("checkpoint", self.streamer.checkpoint()))
+                self.finished = True
+                return
+            self.streamer.replies.maybe_flush()
+            self.streamer.spikes.maybe_check()
+            self.maybe_checkpoint()
+            return
+        if kind == "post":
+            self.streamer.insert_post(item)
+        else:
+            self.streamer.insert_comment(item)
+        self.processed += 1
+        if self.inbox.empty():
+            self.streamer.score_comments()
+        self.streamer.replies.maybe_flush()
+        self.streamer.spikes.maybe_check()
+        self.maybe_checkpoint()
+
+
+class WriterStage(Stage):
+    def __init__(self, writer, inbox, store_checkpoint):
+        super().__init__("writer", inbox=inbox)
+        self.writer = writer
+        self.store_checkpoint = store_checkpoint
+
+    def step(self):
+        try:
+            table, rows = self.inbox.get(timeout=0.5)
+        except Empty:
+            if self.draining:
+                self.writer.flush()
+                self.finished = True
+                return
+            self.writer.maybe_flush()
+            return
+        if table == "checkpoint":
+            self.writer.flush()
+            self.store_checkpoint(rows)
+            return
+        self.writer.add_many(table, rows)
+        self.processed += len(rows)
+
+
+class RefreshPoller(Stage):
+    def __init__(self, streamer, outbox, idle_sleep=1.0):
+        super().__init__("refresher", outbox=outbox)
+        self.streamer = streamer
+        self.idle_sleep = idle_sleep
+
+    def step(self):
+        if self.draining:
+            self.finished = True
+            return
+        if self.streamer.rebalance():
+            self.streamer.open_streams()
+        self.streamer.rotate_jobs()
+        self.streamer.jobs.maybe_save()
+        if not self.streamer.update_batch:
+            sleep(self.idle_sleep)
+            return
+        updates = self.streamer.fetch_updates()
+        self.processed += len(updates)
+        if updates:
+            self.emit(("updates", updates))
+
+
+class Pipeline:
+    def __init__(self, streamer, queue_size=1000, report_every=30):
+        self.streamer = streamer
+        self.report_every = report_every
+        items = Queue(maxsize=queue_size)
+        rows = Queue(maxsize=queue_size)
+        self.queues = {"items": items, "rows": rows}
+        self.reader = StreamReader(streamer, items)
+        self.enricher = Enricher(streamer, items, rows)
+        self.writer = WriterStage(streamer.writer, rows, streamer.store_checkpoint)
+        self.refresher = RefreshPoller(streamer, rows)
+        self.stages = [self.reader, self.enricher, self.writer, self.refresher]
+        streamer.writer = QueueWriter(self.enricher)
+
+    def run(self, stopping=None):
+        # Returns once `stopping` is set and every queued row is written, with the streamer's
+        # own writer back in place for the caller's shutdown.
+        stopping = stopping or threading.Event()
+        for stage in self.stages:
+            stage.start()
+        last = {stage.name: 0 for stage in self.stages}
+        last_report = time()
+        while not stopping.wait(self.report_every):
+            for stage in self.stages:
+                if not stage.is_alive():
+                    raise SystemExit(f"{stage.name} stage died: {stage.error!r}")
+            flusher = self.streamer.flusher
+            if flusher is not None and not flusher.is_alive():
+                raise SystemExit(f"spool flusher died: {flusher.error!r}")
+            now = time()
+            elapsed = now - last_report
+            for stage in self.stages:
+                rate = (stage.processed - last[stage.name]) / elapsed
+                last[stage.name] = stage.processed
+                print(f"{stage.name}: {rate:.1f}/s, total: {stage.processed}, blocked: {stage.blocked:.1f}s")
+            print(", ".join(f"{name} queue: {q.qsize()}" for name, q in self.queues.items()))
+            print(f"jobs: {len(self.streamer.jobs)}")
+            if self.streamer.spool is not None:
+                print(f"spool: {self.streamer.spool.pending_bytes()} bytes, lag {self.streamer.spool.lag():.1f}s")
+            last_report = now
+        self.drain()
+
+    def drain(self):
+        # Sources first, then each queue in order, so a stage only finishes once nothing more
+        # can reach it.
+        self.reader.draining = True
+        self.refresher.draining = True
+        self.reader.join()
+        self.refresher.join()
+        self.enricher.drain()
+        self.writer.drain()
+        self.streamer.writer = self.writer.writer
@@ -0,0 +1,115 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep, time
+from prawcore.exceptions import RequestException, ResponseException, ServerError
+
+INFO_BATCH = 100
+
+
+class TokenBucket:
+    # Starts at Reddit's documented 600 requests per 600s and re-syncs with the
+    # X-Ratelimit-* budget PRAW reports after every response.
+    def __init__(self, rate=1.0, capacity=10.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time()
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time()
+                self.refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            sleep(wait)
+
+    def sync(self, limits):
+        remaining, reset = limits.get("remaining"), limits.get("reset_timestamp")
+        if remaining is None or reset is None:
+            return
+        with self.lock:
+            now = time()
+            self.refill(now)
+            # Spread what's left of the window evenly over the time until it resets; with
+            # nothing left the next token arrives as the window resets.
+            self.rate = max(remaining, 1.0) / max(reset - now, 1.0)
+            self.tokens = min(self.tokens, max(remaining, 0.0))
+
+
+def is_retryable(e):
+    if isinstance(e, (ServerError, RequestException)):
+        return True
+    return isinstance(e, ResponseException) and e.response.status_code == 429
+
+
+class InfoClient:
+    # Wraps reddit.info for one or more OAuth clients: ids go out in exact 100-id chunks
+    # spread over the clients, each behind its own token bucket, and chunks that still fail
+    # after retrying come back to the caller to be requeued rather than dropped.
+    def __init__(self, reddits, max_retries=4, base_delay=1.0, max_delay=30.0):
+        self.reddits = reddits
+        self.buckets = [TokenBucket() for _ in reddits]
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.executor = ThreadPoolExecutor(max_workers=len(reddits), thread_name_prefix="info")
+        self.next_client = 0
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    @property
+    def capacity(self):
+        # Ids worth queueing for one call to fetch: a full chunk per client.
+        return INFO_BATCH * len(self.reddits)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def fetch_chunk(self, client, names):
+        reddit, bucket = self.reddits[client], self.buckets[client]
+        for attempt in range(self.max_retries + 1):
+            bucket.acquire()
+            failed = False
+            try:
+                items = list(reddit.info(fullnames=names))
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                failed = True
+            auth = getattr(reddit, "auth", None)
+            if auth is not None:
+                bucket.sync(auth.limits)
+            with self.lock:
+                self.requests += 1
+                self.errors += failed
+            if not failed:
+                return items
+            if attempt < self.max_retries:
+                sleep(self.backoff(attempt))
+        return None
+
+    def fetch(self, names):
+        # Returns (items, failed ids).
+        chunks = [names[i : i + INFO_BATCH] for i in range(0, len(names), INFO_BATCH)]
+        futures = []
+        for chunk in chunks:
+            futures.append((chunk, self.executor.submit(self.fetch_chunk, self.next_client, chunk)))
+            self.next_client = (self.next_client + 1) % len(self.reddits)
+        items, failed = [], []
+        for chunk, future in futures:
+            result = future.result()
+            if result is None:
+                failed.extend(chunk)
+            else:
+                items.extend(result)
+        return items, failed
@@ -3,7 +3,11 @@ import praw
 import psycopg2
 import psycopg2.extras
 import time
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from archiver import Archiver, store_from_url
+from ticker_api import refresh_leaderboards
+from partitions import PARTITIONED_TABLES, is_partitioned, maintain_partitions, retention_cutoff
 
 
 class RedditUpdater:
@@ -16,6 +20,16 @@ class RedditUpdater:
             user_agent=os.environ["REDDIT_USER_AGENT"],
         )
 
+    @contextmanager
+    def transaction(self):
+        self.connection.autocommit = False
+        try:
+            with self.connection:
+                with self.connection.cursor() as cursor:
+                    yield cursor
+        finally:
+            self.connection.autocommit = True
+
     def pull_ids(self, table_name):
         where_clause = ""
         if table_name == "comments":
@@ -30,8 +44,18 @@ class RedditUpdater:
             update_dict = {id: {"upvotes": 0, "comments": 0} for id in ids}
             return ids, update_dict
 
-    def delete_old(self):
+    def archive_old(self, cutoff):
+        url = os.environ.get("ARCHIVE_URL")
+        if not url:
+            return
+        archived = Archiver(self.connection, store_from_url(url)).archive(cutoff)
+        print(f"Archived: {archived}")
+
+    def delete_old(self, cutoff):
         with self.connection.cursor() as cursor:
+            if all(is_partitioned(cursor, table) for table in PARTITIONED_TABLES):
+                maintain_partitions(cursor, cutoff)
+                return
             cursor.execute(
                 f"""
                 DELETE FROM posts
@@ -40,99 +64,149 @@ class RedditUpdater:
                 WHERE posted < %s;
                 DELETE FROM updates
                 WHERE posted < %s;
+                DELETE FROM mentions
+                WHERE posted < %s;
                 """,
-                [datetime.now() - timedelta(hours=72), datetime.now() - timedelta(hours=72), datetime.now() - timedelta(hours=72)],
+                [cutoff] * 4,
             )
 
     def update_posts(self, update_dict):
+        # One UPDATE ... FROM (VALUES ...) join per batch instead of one UPDATE per id.
         with self.connection.cursor() as cursor:
-            psycopg2.extras.execute_batch(
+            psycopg2.extras.execute_values(
                 cursor,
-                f"""
+                """
                 UPDATE posts
                 SET
-                    upvotes = %s,
-                    comments = %s,
-                    last_updated = %s
+                    upvotes = v.upvotes,
+                    comments = v.comments,
+                    last_updated = now()
+                FROM (VALUES %s) AS v (id, upvotes, comments)
                 WHERE
-                    id = %s;
+                    posts.id = v.id;
             """,
-                [
-                    (update_dict[key]["upvotes"], update_dict[key]["comments"], datetime.now(), key)
-                    for key in update_dict.keys()
-                ],
+                [(key, update_dict[key]["upvotes"], update_dict[key]["comments"]) for key in update_dict.keys()],
+                page_size=max(len(update_dict), 1),
             )
 
     def update_comments(self, update_dict):
         with self.connection.cursor() as cursor:
-            psycopg2.extras.execute_batch(
+            psycopg2.extras.execute_values(
                 cursor,
-                f"""
+                """
                 UPDATE comments
                 SET
-                    upvotes = %s,
-                    last_updated = %s
+                    upvotes = v.upvotes,
+                    last_updated = now()
+                FROM (VALUES %s) AS v (id, upvotes)
                 WHERE
-                    id = %s;
+                    comments.id = v.id;
             """,
-                [(update_dict[key]["upvotes"], datetime.now(), key) for key in update_dict.keys()],
+                [(key, update_dict[key]["upvotes"]) for key in update_dict.keys()],
+                page_size=max(len(update_dict), 1),
             )
 
     def update_tickers(self):
-        dt = {"min_datetime": datetime.now() - timedelta(hours=47)}
-        with self.connection.cursor() as cursor:
+        # Only (hour, ticker) buckets touched since the stored watermark are recomputed. The
+        # watermark lags now() by a minute so rows from still-open COPY transactions aren't skipped.
+        min_datetime = datetime.now() - timedelta(hours=47)
+        with self.transaction() as cursor:
+            cursor.execute("SELECT watermark FROM rollup_watermarks WHERE name = 'tickers' FOR UPDATE")
+            row = cursor.fetchone()
+            cursor.execute("SELECT now() - interval '1 minute'")
+            high_watermark = cursor.fetchone()[0]
+            if row is None:
+                self.rollup_tickers(cursor, min_datetime)
+            else:
+                hours = self.touched_hours(cursor, row[0], high_watermark, min_datetime)
+                if hours:
+                    self.rollup_tickers(cursor, min_datetime, hours)
             cursor.execute(
-                f"""
-            WITH comment_data AS (
-              SELECT date, ticker, AVG(sentiment) as comment_sentiment, SUM(upvotes) AS comment_upvotes, SUM(comments) AS comment_replies, COUNT(DISTINCT id) as comment_mentions
-              FROM (SELECT id, date_trunc('hour', posted) as date, UNNEST(text_mentions) as ticker, sentiment, upvotes, comments from comments WHERE posted > %(min_datetime)s) a
-              GROUP BY date, ticker
-            ),
-            post_title_data AS (
-              SELECT date, ticker, AVG(sentiment) as post_title_sentiment, SUM(upvotes) AS post_title_upvotes, SUM(comments) AS post_title_replies, COUNT(DISTINCT id) as post_title_mentions
-              FROM (SELECT id, date_trunc('hour', posted) as date, UNNEST(title_mentions) as ticker, sentiment, upvotes, comments from posts WHERE posted > %(min_datetime)s) a
-              GROUP BY date, ticker
-            ),
-            post_text_data AS (
-              SELECT date, ticker, AVG(sentiment) as post_text_sentiment, SUM(upvotes) AS post_text_upvotes, SUM(comments) AS post_text_replies, COUNT(DISTINCT id) as post_text_mentions
-              FROM (SELECT id, date_trunc('hour', posted) as date, UNNEST(text_mentions) as ticker, sentiment, upvotes, comments from posts WHERE posted > %(min_datetime)s) a
-              GROUP BY date, ticker
+                """
+                INSERT INTO rollup_watermarks (name, watermark) VALUES ('tickers', %s)
+                ON CONFLICT (name) DO UPDATE SET watermark = EXCLUDED.watermark;
+                """,
+                [high_watermark],
+            )
+            refresh_leaderboards(cursor)
+
+    def touched_hours(self, cursor, watermark, high_watermark, min_datetime):
+        cursor.execute(
+            """
+            SELECT date_trunc('hour', posted) FROM posts
+            WHERE posted > %(min_datetime)s
+              AND ((ingested > %(watermark)s AND ingested <= %(high_watermark)s)
+                OR (last_updated > %(watermark)s AND last_updated <= %(high_watermark)s))
+            UNION
+            SELECT date_trunc('hour', posted) FROM comments
+            WHERE posted > %(min_datetime)s
+              AND ((ingested > %(watermark)s AND ingested <= %(high_watermark)s)
+                OR (last_updated > %(watermark)s AND last_updated <= %(high_watermark)s))
+            UNION
+            SELECT date_trunc('hour', posted) FROM updates
+            WHERE posted > %(min_datetime)s
+              AND last_updated > %(watermark)s AND last_updated <= %(high_watermark)s;
+            """,
+            {"watermark": watermark, "high_watermark": high_watermark, "min_datetime": min_datetime},
+        )
+        return sorted(x[0] for x in cursor.fetchall())
+
+    def rollup_tickers(self, cursor, min_datetime, hours=None):
+        # Reads the mentions index instead of UNNESTing posts and comments; upvotes and reply
+        # counts come from the item rows, which are refreshed in place. Ingestion is at least
+        # once, so an item (and its mentions) can be stored twice: each is counted once, with
+        # its latest refresh.
+        dt = {"min_datetime": min_datetime}
+        hour_filter = ""
+        if hours is not None:
+            dt["hours"] = hours
+            dt["first_hour"] = hours[0]
+            hour_filter = "AND m.posted >= %(first_hour)s AND date_trunc('hour', m.posted) = ANY(%(hours)s)"
+        cursor.execute(
+            f"""
+            WITH m AS (
+              SELECT DISTINCT ON (m.item_id, m.source, m.ticker) m.*
+              FROM mentions m
+              WHERE m.posted > %(min_datetime)s {hour_filter}
+              ORDER BY m.item_id, m.source, m.ticker, m.posted DESC
             ),
-            post_data_combined AS (
-            SELECT
-              COALESCE(a.date, b.date) AS date,
-              COALESCE(a.ticker, b.ticker) AS ticker,
-              post_title_sentiment,
-              post_text_sentiment,
-              COALESCE(post_title_upvotes, 0) AS post_title_upvotes,
-              COALESCE(post_text_upvotes, 0) AS post_text_upvotes,
-              COALESCE(post_title_replies, 0) AS post_title_replies,
-              COALESCE(post_text_replies, 0) AS post_text_replies,
-              COALESCE(post_title_mentions, 0) AS post_title_mentions,
-              COALESCE(post_text_mentions, 0) AS post_text_mentions
-            FROM post_title_data a
-            FULL OUTER JOIN post_text_data b
-              ON a.date = b.date AND a.ticker = b.ticker
+            mention_data AS (
+              SELECT
+                date_trunc('hour', m.posted) AS date,
+                m.ticker,
+                m.source,
+                m.item_id,
+                m.sentiment,
+                COALESCE(c.upvotes, p.upvotes) AS upvotes,
+                COALESCE(c.comments, p.comments) AS replies
+              FROM m
+              LEFT JOIN LATERAL (
+                SELECT upvotes, comments FROM comments
+                WHERE m.source = 1 AND id = m.item_id ORDER BY last_updated DESC LIMIT 1
+              ) c ON true
+              LEFT JOIN LATERAL (
+                SELECT upvotes, comments FROM posts
+                WHERE m.source IN (2, 3) AND id = m.item_id ORDER BY last_updated DESC LIMIT 1
+              ) p ON true
             ),
             ticker_data AS (
             SELECT
-              COALESCE(a.date, b.date) AS date,
-              COALESCE(a.ticker, b.ticker) AS ticker,
-              comment_sentiment,
-              post_title_sentiment,
-              post_text_sentiment,
-              COALESCE(comment_upvotes, 0) AS comment_upvotes,
-              COALESCE(post_title_upvotes, 0) AS post_title_upvotes,
-              COALESCE(post_text_upvotes, 0) AS post_text_upvotes,
-              COALESCE(comment_replies, 0) AS comment_replies,
-              COALESCE(post_title_replies, 0) AS post_title_replies,
-              COALESCE(post_text_replies, 0) AS post_text_replies,
-              COALESCE(comment_mentions, 0) AS comment_mentions,
-              COALESCE(post_title_mentions, 0) AS post_title_mentions,
-              COALESCE(post_text_mentions, 0) AS post_text_mentions
-            FROM comment_data a
-            FULL OUTER JOIN post_data_combined b
-              ON a.date = b.date AND a.ticker = b.ticker
+              date,
+              ticker,
+              AVG(sentiment) FILTER (WHERE source = 1) AS comment_sentiment,
+              AVG(sentiment) FILTER (WHERE source = 2) AS post_title_sentiment,
+              AVG(sentiment) FILTER (WHERE source = 3) AS post_text_sentiment,
+              COALESCE(SUM(upvotes) FILTER (WHERE source = 1), 0) AS comment_upvotes,
+              COALESCE(SUM(upvotes) FILTER (WHERE source = 2), 0) AS post_title_upvotes,
+              COALESCE(SUM(upvotes) FILTER (WHERE source = 3), 0) AS post_text_upvotes,
+              COALESCE(SUM(replies) FILTER (WHERE source = 1), 0) AS comment_replies,
+              COALESCE(SUM(replies) FILTER (WHERE source = 2), 0) AS post_title_replies,
+              COALESCE(SUM(replies) FILTER (WHERE source = 3), 0) AS post_text_replies,
+              COUNT(DISTINCT item_id) FILTER (WHERE source = 1) AS comment_mentions,
+              COUNT(DISTINCT item_id) FILTER (WHERE source = 2) AS post_title_mentions,
+              COUNT(DISTINCT item_id) FILTER (WHERE source = 3) AS post_text_mentions
+            FROM mention_data
+            GROUP BY date, ticker
             )
             INSERT INTO tickers (date, ticker, comment_sentiment, post_title_sentiment, post_text_sentiment,
                                  comment_upvotes, post_title_upvotes, post_text_upvotes, comment_replies,
@@ -154,17 +228,21 @@ class RedditUpdater:
               post_title_mentions = EXCLUDED.post_title_mentions,
               post_text_mentions = EXCLUDED.post_text_mentions;
             """,
-                {**dt},
-            )
+            {**dt},
+        )
 
 
 def main():
     updater = RedditUpdater()
-    updater.delete_old()
-    #
-    # start = time.time()
-    # updater.update_tickers()
-    # print(f"Tickers Updated! Time Spent: {time.time() - start}")
+    # Archiving works in whole hours, so deletion stops at the same hour boundary; anything
+    # newer stays until a later run has archived it.
+    cutoff = retention_cutoff().replace(minute=0, second=0, microsecond=0)
+    updater.archive_old(cutoff)
+    updater.delete_old(cutoff)
+
+    start = time.time()
+    updater.update_tickers()
+    print(f"Tickers Updated! Time Spent: {time.time() - start}")
 
 
 if __name__ == "__main__":
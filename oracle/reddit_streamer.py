@@ -1,134 +1,316 @@
 import os
+import signal
+import threading
+from itertools import chain
 import praw
-from prawcore.exceptions import ServerError
-from flashtext import KeywordProcessor
-from textblob import TextBlob
-from tickers import NYSE, NASDAQ, AMEX
-from collections import deque
+from sentiment import LexiconSentiment
+from bulk_writer import BulkWriter
+from checkpoints import Checkpoints, RecentIds
+from pipeline import Pipeline
+from reddit_client import InfoClient
+import ids
+import metrics
+from reply_counter import ReplyCounter
+from scheduler import RefreshScheduler
+from sharding import ShardCoordinator
+from spikes import SpikeDetector
+from spool import Spool, SpoolFlusher
+from ticker_matcher import TickerMatcher
 import psycopg2
-import psycopg2.extras
 from datetime import datetime
 import redis
+from redis.exceptions import RedisError
 import time
-from time import time, sleep
+from time import time
 
 
-class RedditStreamer:
-    def __init__(self):
-        self.r = redis.StrictRedis.from_url(
-            os.environ.get("REDIS_URL"), charset="utf-8", decode_responses=True
+TTLS = {"t3": 2 * 24 * 60 * 60, "t1": 36 * 60 * 60}
+SUBREDDITS = [x.strip() for x in os.environ.get("SUBREDDITS", "wallstreetbets").split(",") if x.strip()]
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "1"))
+SPOOL_DIR = os.environ.get("SPOOL_DIR", "spool")
+# mentions.source
+COMMENT_TEXT, POST_TITLE, POST_TEXT = 1, 2, 3
+
+
+def make_reddit():
+    return praw.Reddit(
+        client_id=os.environ["REDDIT_CLIENT_ID"],
+        client_secret=os.environ["REDDIT_CLIENT_SECRET"],
+        user_agent=os.environ["REDDIT_USER_AGENT"],
+    )
+
+
+def connect_db():
+    return psycopg2.connect(os.environ["DATABASE_URL"], sslmode="require")
+
+
+def make_refresh_reddits(primary):
+    # REDDIT_REFRESH_CREDENTIALS="id:secret,id:secret" adds OAuth apps, each with its own rate budget.
+    reddits = [primary]
+    for credential in filter(None, os.environ.get("REDDIT_REFRESH_CREDENTIALS", "").split(",")):
+        client_id, client_secret = credential.strip().split(":", 1)
+        reddits.append(
+            praw.Reddit(
+                client_id=client_id,
+                client_secret=client_secret,
+                user_agent=os.environ["REDDIT_USER_AGENT"],
+            )
         )
-        self.jobs = deque(self.r.keys() or [])
-        self.connection = psycopg2.connect(os.environ["DATABASE_URL"], sslmode="require")
-        self.connection.autocommit = True
-        self.reddit = praw.Reddit(
-            client_id=os.environ["REDDIT_CLIENT_ID"],
-            client_secret=os.environ["REDDIT_CLIENT_SECRET"],
-            user_agent=os.environ["REDDIT_USER_AGENT"],
+    return reddits
+
+
+class RedditStreamer:
+    def __init__(self, r=None, connection=None, reddit=None, spool=None):
+        if r is None:
+            r = redis.StrictRedis.from_url(
+                os.environ.get("REDIS_URL"),
+                charset="utf-8",
+                decode_responses=True,
+                socket_timeout=5,
+                socket_connect_timeout=5,
+            )
+        self.r = r
+        self.replies = ReplyCounter(self.r)
+        self.jobs = RefreshScheduler(self.r)
+        self.shards = ShardCoordinator(self.r, SUBREDDITS, SHARD_COUNT)
+        self.shards.heartbeat()
+        self.load_jobs()
+        # Without a connection of its own the streamer never talks to Postgres directly: rows
+        # go to a local spool and the flusher thread (started by main) replays them, so
+        # ingestion keeps going while the database is down.
+        self.flusher = None
+        if connection is None and spool is None:
+            spool = Spool(SPOOL_DIR)
+            self.flusher = SpoolFlusher(spool, connect_db, on_checkpoint=self.save_checkpoint)
+        self.connection = connection
+        self.spool = spool
+        self.writer = BulkWriter(self.connection, spool=self.spool)
+        self.reddit = reddit or make_reddit()
+        self.info = InfoClient([self.reddit])
+        self.recent = RecentIds(self.r)
+        self.checkpoints = Checkpoints(self.r)
+        self.open_streams()
+        self.matcher = TickerMatcher()
+        self.sentiment = LexiconSentiment()
+        self.spikes = SpikeDetector(self.r)
+        self.comments = []
+        self.update_batch = []
+        self.t1 = 0
+        self.t3 = 0
+
+    def load_jobs(self):
+        tracked = [name for name in self.replies.scan() if self.shards.owns(name)]
+        for name in tracked:
+            expires = self.replies.expiry[name]
+            self.jobs.add(name, expires - TTLS[name[:2]], expires)
+        self.jobs.restore(tracked)
+
+    def open_streams(self):
+        subreddits = self.shards.owned_subreddits()
+        if not subreddits:
+            self.posts_stream = iter(())
+            self.comments_stream = iter(())
+            return
+        # With a checkpoint to resume from, the gap is replayed from listings and the stream's
+        # initial batch isn't skipped; RecentIds drops whatever was already ingested.
+        resume = any(
+            self.checkpoints.get(kind, name) is not None for kind in ("posts", "comments") for name in subreddits
         )
-        self.posts_stream = self.reddit.subreddit("wallstreetbets").stream.submissions(
-            pause_after=-1, skip_existing=True
+        subreddit = self.reddit.subreddit("+".join(subreddits))
+        self.posts_stream = chain(
+            self.backfill("posts", subreddits),
+            subreddit.stream.submissions(pause_after=-1, skip_existing=not resume),
         )
-        self.comments_stream = self.reddit.subreddit("wallstreetbets").stream.comments(
-            pause_after=-1, skip_existing=True
+        self.comments_stream = chain(
+            self.backfill("comments", subreddits),
+            subreddit.stream.comments(pause_after=-1, skip_existing=not resume),
         )
-        self.keyword_processor = KeywordProcessor()
-        self.keyword_processor.add_keywords_from_list(NYSE + NASDAQ + AMEX)
-        self.comments = []
-        self.update_batch = []
+
+    def backfill(self, kind, subreddits, limit=1000, slack=300):
+        for name in subreddits:
+            since = self.checkpoints.get(kind, name)
+            if since is None:
+                continue
+            subreddit = self.reddit.subreddit(name)
+            listing = subreddit.new(limit=limit) if kind == "posts" else subreddit.comments(limit=limit)
+            items = []
+            for item in listing:
+                if item.created_utc < since - slack:
+                    break
+                items.append(item)
+            else:
+                if len(items) >= limit:
+                    print(f"Backfill of r/{name} {kind} hit the {limit} item listing limit, older items are lost")
+            print(f"Backfilling {len(items)} {kind} from r/{name}")
+            yield from reversed(items)
+        yield None
+
+    def checkpoint(self):
+        # Taken before the writer flushes and stored after, so an id is only marked as
+        # ingested (and a checkpoint only moves past it) once its row is in the database.
+        return self.recent.take(), self.checkpoints.take()
+
+    def store_checkpoint(self, state):
+        if self.spool is not None:
+            # Behind the rows in the spool: the flusher saves it once they are committed. The
+            # spool may not survive a restart (Heroku's filesystem doesn't), and then the
+            # checkpoints left in Redis still cover the lost rows and backfill reloads them.
+            self.spool.append_checkpoint(state)
+        else:
+            self.save_checkpoint(state)
+
+    def save_checkpoint(self, state):
+        recent, latest = state
+        self.recent.store(recent)
+        self.checkpoints.store(latest)
+
+    def flush(self):
+        self.score_comments()
+        state = self.checkpoint()
+        self.writer.flush()
+        self.store_checkpoint(state)
+
+    def track(self, name, created):
+        # Every worker counts replies, but only the shard that owns an id refreshes it.
+        ttl = TTLS[name[:2]]
+        self.replies.register(name, ttl)
+        if self.shards.owns(name):
+            self.jobs.add(name, created, time() + ttl)
+        else:
+            self.shards.handoff(name, created, time() + ttl)
+
+    def rebalance(self):
+        if not self.shards.due():
+            return False
+        # Redis errors here are retried at the next heartbeat rather than stopping ingestion.
+        try:
+            gained, lost = self.shards.heartbeat()
+        except RedisError as e:
+            print(f"Shard heartbeat failed, will retry: {e}")
+            return False
+        if lost:
+            self.jobs.retain(self.shards.owns)
+        if gained:
+            try:
+                self.replies.flush()
+                self.load_jobs()
+                self.checkpoints.load()
+                self.recent.load()
+            except RedisError as e:
+                # Given up until their leases lapse and a heartbeat takes them again, loaded properly.
+                print(f"Loading state for shards {sorted(gained)} failed: {e}")
+                self.shards.owned -= gained
+                self.jobs.retain(self.shards.owns)
+        try:
+            self.shards.flush_handoffs()
+            for name, created, expires in self.shards.receive():
+                self.jobs.add(name, created, expires)
+        except RedisError as e:
+            print(f"Exchanging handed-off jobs failed, will retry: {e}")
+        return bool(gained or lost)
 
     def insert_post(self, submission):
-        title_keywords = [
-            x.replace("$", "") for x in self.keyword_processor.extract_keywords(submission.title)
-        ]
-        text_keywords = [
-            x.replace("$", "") for x in self.keyword_processor.extract_keywords(submission.selftext)
-        ]
+        if not self.recent.add(submission.name):
+            return
+        self.checkpoints.record("posts", str(submission.subreddit), submission.created_utc)
+        title_keywords = self.matcher.extract(submission.title)
+        text_keywords = self.matcher.extract(submission.selftext)
         sub = {
             "posted": datetime.utcfromtimestamp(submission.created_utc),
             "last_updated": datetime.utcfromtimestamp(submission.created_utc),
-            "id": submission.name,
+            "id": ids.decode(submission.name),
             "title": submission.title,
-            "title_mentions": list(set(title_keywords)),
-            "text_mentions": list(set(text_keywords)),
-            "sentiment": TextBlob(submission.title).sentiment.polarity,
+            "title_mentions": title_keywords,
+            "text_mentions": text_keywords,
+            "sentiment": self.sentiment.score(submission.title),
             "upvotes": submission.ups,
             "comments": submission.num_comments,
         }
-        with self.connection.cursor() as cursor:
-            cursor.execute(
-                """
-                INSERT INTO posts VALUES (
-                %(posted)s,
-                %(last_updated)s,
-                %(id)s,
-                %(title)s,
-                %(title_mentions)s,
-                %(text_mentions)s,
-                %(sentiment)s,
-                %(upvotes)s,
-                %(comments)s
-                );
-            """,
-                {**sub},
-            )
-            if len(title_keywords) > 0 or len(text_keywords) > 0:
-                self.r.set(name=submission.name, value=0, ex=2 * 24 * 60 * 60)
-                self.jobs.appendleft(submission.name)
+        self.writer.add("posts", sub)
+        self.add_mentions(title_keywords, sub, POST_TITLE)
+        self.add_mentions(text_keywords, sub, POST_TEXT)
+        self.spikes.observe(set(title_keywords).union(text_keywords), sub["sentiment"], submission.created_utc)
+        if len(title_keywords) > 0 or len(text_keywords) > 0:
+            self.track(submission.name, submission.created_utc)
 
     def insert_comment(self, comment):
-        keywords = [
-            x.replace("$", "") for x in self.keyword_processor.extract_keywords(comment.body)
-        ]
+        if not self.recent.add(comment.name):
+            return
+        self.checkpoints.record("comments", str(comment.subreddit), comment.created_utc)
+        keywords = self.matcher.extract(comment.body)
         self.comments.append(
             {
                 "posted": datetime.utcfromtimestamp(comment.created_utc),
                 "last_updated": datetime.utcfromtimestamp(comment.created_utc),
-                "id": comment.name,
+                "id": ids.decode(comment.name),
                 "text": comment.body[:50],
-                "text_mentions": list(set(keywords)),
-                "sentiment": TextBlob(comment.body).sentiment.polarity,
+                "body": comment.body,
+                "created": comment.created_utc,
+                "text_mentions": keywords,
                 "upvotes": comment.ups,
                 "comments": 0,
             }
         )
         parent_id = comment.parent_id
-        if parent_id is not None and self.r.exists(parent_id):
-            self.r.incr(parent_id)
+        if parent_id is not None:
+            self.replies.incr(parent_id)
 
         if len(keywords) > 0:
-            self.r.set(name=comment.name, value=0, ex=36 * 60 * 60)
-            self.jobs.appendleft(comment.name)
+            self.track(comment.name, comment.created_utc)
 
         if len(self.comments) >= 100:
-            with self.connection.cursor() as cursor:
-                psycopg2.extras.execute_batch(
-                    cursor,
-                    """
-                    INSERT INTO comments VALUES (
-                    %(posted)s,
-                    %(last_updated)s,
-                    %(id)s,
-                    %(text)s,
-                    %(text_mentions)s,
-                    %(sentiment)s,
-                    %(upvotes)s,
-                    %(comments)s
-                    );
-                """,
-                    ({**tmp_comment} for tmp_comment in self.comments),
-                )
-            self.comments = []
+            self.score_comments()
+
+    def add_mentions(self, tickers, row, source):
+        for ticker in tickers:
+            self.writer.add(
+                "mentions",
+                {
+                    "ticker": ticker,
+                    "posted": row["posted"],
+                    "item_id": row["id"],
+                    "source": source,
+                    "sentiment": row["sentiment"],
+                },
+            )
+
+    def score_comments(self):
+        if not self.comments:
+            return
+        scores = self.sentiment.score_batch([tmp_comment.pop("body") for tmp_comment in self.comments])
+        for tmp_comment, score in zip(self.comments, scores):
+            tmp_comment["sentiment"] = score
+            self.spikes.observe(tmp_comment["text_mentions"], score, tmp_comment.pop("created"))
+        self.writer.add_many("comments", self.comments)
+        for tmp_comment in self.comments:
+            self.add_mentions(tmp_comment["text_mentions"], tmp_comment, COMMENT_TEXT)
+        self.comments = []
+
+    def rotate_jobs(self, count=None):
+        # Tops the batch up to a full 100-id chunk per client; ids that failed last time stay in it.
+        count = count or self.info.capacity
+        if self.jobs.due() and len(self.update_batch) < count:
+            self.update_batch.extend(self.jobs.pop(count - len(self.update_batch)))
 
     def update_comments(self):
+        self.writer.add_many("updates", self.fetch_updates())
+
+    def fetch_updates(self):
         updates = []
-        for item in self.reddit.info(fullnames=self.update_batch):
+        try:
+            replies = self.replies.counts([id for id in self.update_batch if id.startswith("t1")])
+        except RedisError as e:
+            # The batch is kept and goes out again next round.
+            print(f"Reading reply counts failed, will retry: {e}")
+            return updates
+        items, failed = self.info.fetch(self.update_batch)
+        for item in items:
             if item.name.startswith("t3"):
                 self.t3 += 1
                 num_comments = item.num_comments
             elif item.name.startswith("t1"):
                 self.t1 += 1
-                num_comments = int(self.r.get(item.name) or 0)
+                num_comments = replies.get(item.name, 0)
             else:
                 print(f"DEBUG: {item.name}")
                 num_comments = 0
@@ -136,37 +318,57 @@ class RedditStreamer:
                 {
                     "posted": datetime.utcfromtimestamp(item.created_utc),
                     "last_updated": datetime.now(),
-                    "id": item.name,
+                    "id": ids.decode(item.name),
+                    "kind": ids.kind_of(item.name),
                     "upvotes": item.ups,
                     "comments": num_comments,
                 }
             )
-        with self.connection.cursor() as cursor:
-            psycopg2.extras.execute_batch(
-                cursor,
-                """
-                INSERT INTO updates VALUES (
-                %(posted)s,
-                %(last_updated)s,
-                %(id)s,
-                %(upvotes)s,
-                %(comments)s
-                );
-            """,
-                ({**tmp_comment} for tmp_comment in updates),
-            )
-        self.update_batch = []
+            self.jobs.record(item.name, item.ups + num_comments)
+        # Ids reddit didn't return are rescheduled; ids whose request failed go out again next batch.
+        seen = set(item.name for item in items).union(failed)
+        for id in self.update_batch:
+            if id not in seen:
+                self.jobs.record(id)
+        self.update_batch = failed
+        return updates
 
 
 def main():
     streamer = RedditStreamer()
+    stopping = threading.Event()
+
+    def shutdown(signum, frame):
+        # Only flags it: the handler can run while the main thread holds one of the locks
+        # flushing takes, or is halfway through a flush.
+        stopping.set()
+
+    def stop():
+        streamer.flush()
+        streamer.replies.flush()
+        streamer.jobs.save()
+        streamer.shards.release()
+        if streamer.flusher is not None:
+            # Whatever doesn't make it into Postgres in time is replayed on the next start.
+            streamer.flusher.drain(10)
+            streamer.spool.close()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    streamer.shards.keep_alive()
+    if streamer.flusher is not None:
+        streamer.flusher.start()
+    metrics.start_from_env(streamer)
+    if os.environ.get("STREAMER_MODE") == "pipeline":
+        streamer.info = InfoClient(make_refresh_reddits(make_reddit()))
+        Pipeline(streamer).run(stopping)
+        stop()
+        return
+    streamer.info = InfoClient(make_refresh_reddits(streamer.reddit))
     c, p = 0, 0
-    streamer.t3 = 0
-    streamer.t1 = 0
     overall_start = time()
     inc = 0
 
-    while True:
+    while not stopping.is_set():
         inc += 1
         for post in streamer.posts_stream:
             if post is None:
@@ -180,24 +382,32 @@ def main():
             c += 1
             streamer.insert_comment(comment)
 
-        for i in range(min(50, len(streamer.jobs))):
-            id = streamer.jobs.pop()
-            streamer.update_batch.append(id)
-            if streamer.r.exists(id):
-                streamer.jobs.appendleft(id)
+        streamer.score_comments()
+        if streamer.writer.due():
+            streamer.flush()
+        if streamer.flusher is not None and not streamer.flusher.is_alive():
+            raise SystemExit(f"spool flusher died: {streamer.flusher.error!r}")
+        streamer.replies.maybe_flush()
+        streamer.jobs.maybe_save()
+        for alert in streamer.spikes.maybe_check():
+            print(f"Spike: {alert['ticker']} {alert['mentions']} mentions in {streamer.spikes.recent}m (z={alert['z']:.1f})")
 
-        if len(streamer.update_batch) >= 100:
-            try:
-                streamer.update_comments()
-            except ServerError:
-                print("Reddit Server Error")
-                sleep(1)
+        if streamer.rebalance():
+            streamer.open_streams()
+        streamer.rotate_jobs()
+
+        if streamer.update_batch:
+            streamer.update_comments()
 
         if inc % 100 == 0:
             print(
                 f"comments added: {c}, posts added: {p}, comments updated: {streamer.t1}, posts updated: {streamer.t3}"
             )
             print(f"APS: {(c + p + streamer.t3 + streamer.t1) / (time() - overall_start)}")
+            print(f"redis round-trips: {streamer.replies.round_trips}")
+            if streamer.spool is not None:
+                print(f"spool: {streamer.spool.pending_bytes()} bytes, lag {streamer.spool.lag():.1f}s")
+    stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+import threading
+from collections import Counter
+from time import time
+from redis.exceptions import RedisError
+
+
+class ReplyCounter:
+    def __init__(self, r, max_pending=500, max_age=2.0, prune_every=600):
+        self.r = r
+        self.max_pending = max_pending
+        self.max_age = max_age
+        self.prune_every = prune_every
+        self.lock = threading.Lock()
+        # name -> unix time its Redis key expires, for every id this process knows is tracked
+        self.expiry = {}
+        self.pending_sets = {}
+        self.pending_incrs = Counter()
+        self.oldest = None
+        self.last_prune = time()
+        self.round_trips = 0
+        self.errors = 0
+
+    def scan(self, batch=1000):
+        names = []
+        for name in self.r.scan_iter(match="t[13]_*", count=batch):
+            names.append(name)
+            if len(names) >= batch:
+                yield from self.load_ttls(names)
+                names = []
+        if names:
+            yield from self.load_ttls(names)
+
+    def load_ttls(self, names):
+        pipe = self.r.pipeline(transaction=False)
+        for name in names:
+            pipe.ttl(name)
+        ttls = pipe.execute()
+        self.round_trips += 1
+        now = time()
+        with self.lock:
+            for name, ttl in zip(names, ttls):
+                if ttl is not None and ttl > 0:
+                    self.expiry[name] = now + ttl
+        return [name for name, ttl in zip(names, ttls) if ttl is not None and ttl > 0]
+
+    def register(self, name, ttl):
+        with self.lock:
+            self.expiry[name] = time() + ttl
+            self.pending_sets[name] = ttl
+            self.touch()
+
+    def incr(self, name):
+        with self.lock:
+            expires = self.expiry.get(name)
+            if expires is None or expires <= time():
+                return False
+            self.pending_incrs[name] += 1
+            self.touch()
+            return True
+
+    def touch(self):
+        if self.oldest is None:
+            self.oldest = time()
+
+    def pending(self):
+        return len(self.pending_sets) + len(self.pending_incrs)
+
+    def due(self):
+        if self.oldest is None:
+            return False
+        return self.pending() >= self.max_pending or time() - self.oldest >= self.max_age
+
+    def maybe_flush(self):
+        if self.due():
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            sets, incrs = self.pending_sets, self.pending_incrs
+            self.pending_sets, self.pending_incrs = {}, Counter()
+            self.oldest = None
+            if time() - self.last_prune >= self.prune_every:
+                self.prune()
+        if not sets and not incrs:
+            return
+        # MULTI/EXEC, so a failed flush applied none of it and putting it all back can't count
+        # a reply twice. Registrations go first so replies counted in the same window land on
+        # the fresh key.
+        pipe = self.r.pipeline(transaction=True)
+        for name, ttl in sets.items():
+            pipe.set(name=name, value=0, ex=ttl)
+        for name, count in incrs.items():
+            pipe.incrby(name, count)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            # Put back to go out with the next flush.
+            with self.lock:
+                for name, ttl in sets.items():
+                    self.pending_sets.setdefault(name, ttl)
+                self.pending_incrs.update(incrs)
+                self.touch()
+            self.errors += 1
+            print(f"Reply count flush failed, will retry: {e}")
+            return
+        self.round_trips += 1
+
+    def prune(self):
+        now = time()
+        self.expiry = {name: expires for name, expires in self.expiry.items() if expires > now}
+        self.last_prune = now
+
+    def counts(self, names):
+        if not names:
+            return {}
+        values = self.r.mget(names)
+        self.round_trips += 1
+        with self.lock:
+            return {
+                name: int(value or 0) + self.pending_incrs.get(name, 0)
+                for name, value in zip(names, values)
+            }
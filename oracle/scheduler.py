@@ -0,0 +1,250 @@
+import math
+import threading
+from array import array
+from time import time
+from redis.exceptions import RedisError
+from ids import pack, unpack
+
+NAN = float("nan")
+
+
+class RefreshScheduler:
+    def __init__(
+        self,
+        r=None,
+        key="refresh_schedule",
+        min_interval=60,
+        max_interval=2 * 60 * 60,
+        age_factor=0.05,
+        velocity_scale=20.0,
+        save_every=30,
+    ):
+        self.r = r
+        self.key = key
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.age_factor = age_factor
+        self.velocity_scale = velocity_scale
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        # Ids are kept as ints (ids.pack) mapped to a slot in the column arrays below; freed
+        # slots are reused. A due of NaN marks an id handed out by pop and not yet recorded,
+        # and a NaN last_score one that was never scored.
+        self.slots = {}
+        self.free = []
+        self.keys = array("q")
+        self.due_at = array("d")
+        self.created = array("d")
+        self.expires = array("d")
+        self.last_score = array("d")
+        self.last_refresh = array("d")
+        self.velocity = array("d")
+        self.columns = (self.due_at, self.created, self.expires, self.last_score, self.last_refresh, self.velocity)
+        # Min-heap of slots ordered by due_at, with each slot's index in it (-1 when not queued).
+        self.heap = array("l")
+        self.position = array("l")
+        self.dirty = set()
+        self.dropped = set()
+        self.last_save = time()
+        self.errors = 0
+
+    def __len__(self):
+        return len(self.slots)
+
+    def interval(self, age, velocity):
+        # Young items and items whose score is moving (points per hour) come back sooner.
+        interval = (self.min_interval + age * self.age_factor) / (1.0 + velocity / self.velocity_scale)
+        return max(self.min_interval, min(interval, self.max_interval))
+
+    def add(self, name, created, expires, due=None):
+        now = time()
+        if due is None:
+            due = now + self.interval(max(0.0, now - created), 0.0)
+        key = pack(name)
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                slot = self.allocate(key)
+            self.created[slot] = created
+            self.expires[slot] = expires
+            self.last_score[slot] = NAN
+            self.last_refresh[slot] = NAN
+            self.velocity[slot] = 0.0
+            self.schedule(slot, due)
+            self.dirty.add(key)
+            self.dropped.discard(key)
+
+    def allocate(self, key):
+        if self.free:
+            slot = self.free.pop()
+            self.keys[slot] = key
+        else:
+            slot = len(self.keys)
+            self.keys.append(key)
+            self.position.append(-1)
+            for column in self.columns:
+                column.append(NAN)
+        self.slots[key] = slot
+        return slot
+
+    def remove(self, key):
+        slot = self.slots.pop(key)
+        if self.position[slot] >= 0:
+            self.unqueue(slot)
+        self.free.append(slot)
+        self.dirty.discard(key)
+
+    def schedule(self, slot, due):
+        self.due_at[slot] = due
+        i = self.position[slot]
+        if i < 0:
+            i = len(self.heap)
+            self.heap.append(slot)
+            self.position[slot] = i
+        self.sift_down(self.sift_up(i))
+
+    def unqueue(self, slot):
+        i = self.position[slot]
+        last = self.heap.pop()
+        self.position[slot] = -1
+        if last != slot:
+            self.heap[i] = last
+            self.position[last] = i
+            self.sift_down(self.sift_up(i))
+
+    def sift_up(self, i):
+        heap, position, due_at = self.heap, self.position, self.due_at
+        slot = heap[i]
+        due = due_at[slot]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if due_at[heap[parent]] <= due:
+                break
+            heap[i] = heap[parent]
+            position[heap[i]] = i
+            i = parent
+        heap[i] = slot
+        position[slot] = i
+        return i
+
+    def sift_down(self, i):
+        heap, position, due_at = self.heap, self.position, self.due_at
+        n = len(heap)
+        slot = heap[i]
+        due = due_at[slot]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and due_at[heap[child + 1]] < due_at[heap[child]]:
+                child += 1
+            if due <= due_at[heap[child]]:
+                break
+            heap[i] = heap[child]
+            position[heap[i]] = i
+            i = child
+        heap[i] = slot
+        position[slot] = i
+        return i
+
+    def due(self, now=None):
+        now = now or time()
+        with self.lock:
+            return len(self.heap) > 0 and self.due_at[self.heap[0]] <= now
+
+    def pop(self, count):
+        # Always hands out the most overdue ids, even ones not yet due, so refreshes use full batches.
+        names = []
+        now = time()
+        with self.lock:
+            while len(names) < count and self.heap:
+                slot = self.heap[0]
+                key = self.keys[slot]
+                if self.expires[slot] <= now:
+                    self.drop(key)
+                    continue
+                self.unqueue(slot)
+                self.due_at[slot] = NAN
+                names.append(unpack(key))
+        return names
+
+    def record(self, name, score=None, now=None):
+        now = now or time()
+        key = pack(name)
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                return
+            if self.expires[slot] <= now:
+                self.drop(key)
+                return
+            velocity = self.velocity[slot]
+            last_score, last_refresh = self.last_score[slot], self.last_refresh[slot]
+            if score is not None and not math.isnan(last_score) and now > last_refresh:
+                velocity = abs(score - last_score) * 3600.0 / (now - last_refresh)
+            if score is not None:
+                self.last_score[slot] = score
+                self.last_refresh[slot] = now
+            self.velocity[slot] = velocity
+            self.schedule(slot, now + self.interval(now - self.created[slot], velocity))
+            self.dirty.add(key)
+
+    def drop(self, key):
+        self.remove(key)
+        self.dropped.add(key)
+
+    def maybe_save(self):
+        if self.r is not None and time() - self.last_save >= self.save_every:
+            self.save()
+
+    def save(self):
+        with self.lock:
+            dirty, dropped_keys = self.dirty, self.dropped
+            dues = {}
+            for key in dirty:
+                due = self.due_at[self.slots[key]]
+                if not math.isnan(due):
+                    dues[unpack(key)] = due
+            dropped = [unpack(key) for key in dropped_keys]
+            self.dirty = set()
+            self.dropped = set()
+            self.last_save = time()
+        pipe = self.r.pipeline(transaction=False)
+        if dues:
+            pipe.zadd(self.key, dues)
+        if dropped:
+            pipe.zrem(self.key, *dropped)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            # Marked again, so the next save writes them (or their newer state) out.
+            with self.lock:
+                self.dirty |= {key for key in dirty if key in self.slots}
+                self.dropped |= {key for key in dropped_keys if key not in self.slots}
+            self.errors += 1
+            print(f"Saving the refresh schedule failed, will retry: {e}")
+
+    def restore(self, names):
+        if self.r is None or not names:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for name in names:
+            pipe.zscore(self.key, name)
+        scores = pipe.execute()
+        with self.lock:
+            for name, due in zip(names, scores):
+                key = pack(name)
+                slot = self.slots.get(key)
+                if slot is None:
+                    continue
+                if due is not None:
+                    self.schedule(slot, due)
+                self.dirty.add(key)
+        # The set is shared by all workers, so only entries nobody could still be tracking
+        # (ids live at most two days) are cleaned up here.
+        self.r.zremrangebyscore(self.key, "-inf", time() - 2 * 24 * 60 * 60)
+
+    def retain(self, keep):
+        with self.lock:
+            for key in [key for key in self.slots if not keep(unpack(key))]:
+                self.remove(key)
@@ -0,0 +1,116 @@
+from array import array
+from collections import OrderedDict
+from textblob import TextBlob
+from textblob.en import sentiment as pattern_sentiment
+from textblob._text import EMOTICONS, PUNCTUATION
+
+# LexiconSentiment replays the pattern/TextBlob assessment rules token for token, so scores
+# match TextBlob(text).sentiment.polarity up to float rounding. The benchmark asserts this.
+TOLERANCE = 1e-9
+
+
+class TextBlobSentiment:
+    def score(self, text):
+        return TextBlob(text).sentiment.polarity
+
+    def score_batch(self, texts):
+        return [self.score(text) for text in texts]
+
+
+class LexiconSentiment:
+    def __init__(self, cache_size=50000):
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.tokenizer = pattern_sentiment.tokenizer
+        self.negations = frozenset(pattern_sentiment.negations)
+        self.compile()
+
+    def compile(self):
+        # word -> row in the polarity/intensity/modifier arrays. Only the part-of-speech
+        # averaged (None) entry is ever used for plain strings.
+        self.vocab = {}
+        self.polarity = array("d")
+        self.intensity = array("d")
+        self.is_modifier = array("b")
+        for word, senses in pattern_sentiment.items():
+            p, s, i = senses[None]
+            self.vocab[word] = len(self.polarity)
+            self.polarity.append(p)
+            self.intensity.append(i)
+            self.is_modifier.append(any(pos in senses for pos in pattern_sentiment.modifiers))
+        self.emoticons = {}
+        for (_, p), faces in EMOTICONS.items():
+            for face in faces:
+                self.emoticons.setdefault(face.lower(), p)
+
+    def score(self, text):
+        return self.score_batch([text])[0]
+
+    def score_batch(self, texts):
+        scores = []
+        for text in texts:
+            score = self.cache.get(text)
+            if score is None:
+                self.misses += 1
+                score = self.polarity_of(self.tokenize(text))
+                self.cache[text] = score
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            else:
+                self.hits += 1
+                self.cache.move_to_end(text)
+            scores.append(score)
+        return scores
+
+    def tokenize(self, text):
+        return [w.lower() for w in " ".join(self.tokenizer(text)).split()]
+
+    def polarity_of(self, words):
+        # Same control flow as textblob._text.Sentiment.assessments with pos=None;
+        # each assessment is [polarity, intensity, negated].
+        a = []
+        m = None
+        n = None
+        vocab = self.vocab
+        for w in words:
+            idx = vocab.get(w)
+            if idx is not None:
+                p = self.polarity[idx]
+                i = self.intensity[idx]
+                if m is None:
+                    a.append([p, i, False])
+                else:
+                    a[-1][0] = max(-1.0, min(p * a[-1][1], +1.0))
+                    a[-1][1] = i
+                if n is not None:
+                    a[-1][1] = 1.0 / a[-1][1]
+                    a[-1][2] = True
+                m = None
+                n = None
+                if self.is_modifier[idx]:
+                    m = w
+                if w in self.negations:
+                    n = w
+            else:
+                if w in self.negations:
+                    n = w
+                elif n and len(w.strip("'")) > 1:
+                    n = None
+                if n is not None and m is not None and m.endswith("ly"):
+                    a[-1][2] = True
+                    n = None
+                elif m and len(w) > 2:
+                    m = None
+                if w == "!" and len(a) > 0:
+                    a[-1][0] = max(-1.0, min(a[-1][0] * 1.25, +1.0))
+                if w == "(!)":
+                    a.append([0.0, 1.0, False])
+                if w.isalpha() is False and len(w) <= 5 and w not in PUNCTUATION:
+                    p = self.emoticons.get(w)
+                    if p is not None:
+                        a.append([p, 1.0, False])
+        if not a:
+            return 0.0
+        return sum(p * -0.5 if negated else p for p, _, negated in a) / float(len(a))
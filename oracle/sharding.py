@@ -0,0 +1,152 @@
+import math
+import threading
+import uuid
+import zlib
+from collections import defaultdict
+from time import sleep, time
+from redis.exceptions import RedisError, WatchError
+
+
+def shard_of(name, shard_count):
+    return zlib.crc32(name.encode("utf-8")) % shard_count
+
+
+class ShardCoordinator:
+    # Shard i owns subreddits[i::shard_count] and every fullname whose crc32 lands on i.
+    # Workers hold shards through expiring Redis leases and spread them evenly over the
+    # live workers, so a dead worker's shards are picked up once its leases lapse.
+    def __init__(self, r, subreddits, shard_count=1, lease_ttl=30, heartbeat_every=10):
+        self.r = r
+        self.subreddits = subreddits
+        self.shard_count = shard_count
+        self.lease_ttl = lease_ttl
+        self.heartbeat_every = heartbeat_every
+        self.worker_id = uuid.uuid4().hex
+        self.owned = set()
+        self.last_heartbeat = 0
+        self.handoffs = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def lease_key(self, shard):
+        return f"shard:{shard}"
+
+    def jobs_key(self, shard):
+        return f"shard_jobs:{shard}"
+
+    def if_holding(self, shard, action):
+        # Renews or releases a lease only if this worker still holds it.
+        key = self.lease_key(shard)
+        with self.r.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != self.worker_id:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                if action == "renew":
+                    pipe.expire(key, self.lease_ttl)
+                else:
+                    pipe.delete(key)
+                pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    def owns(self, name):
+        return shard_of(name, self.shard_count) in self.owned
+
+    def owned_subreddits(self):
+        return [sub for i, sub in enumerate(self.subreddits) if i % self.shard_count in self.owned]
+
+    def due(self):
+        return time() - self.last_heartbeat >= self.heartbeat_every
+
+    def heartbeat(self):
+        now = time()
+        self.last_heartbeat = now
+        lost = set()
+        for shard in list(self.owned):
+            if not self.if_holding(shard, "renew"):
+                self.owned.discard(shard)
+                lost.add(shard)
+        pipe = self.r.pipeline(transaction=False)
+        pipe.zadd("workers", {self.worker_id: now})
+        pipe.zremrangebyscore("workers", "-inf", now - 3 * self.lease_ttl)
+        pipe.zcount("workers", now - self.lease_ttl, "+inf")
+        live = max(1, pipe.execute()[2])
+        target = math.ceil(self.shard_count / live)
+        gained = set()
+        for shard in range(self.shard_count):
+            if len(self.owned) >= target:
+                break
+            if shard not in self.owned and self.r.set(self.lease_key(shard), self.worker_id, nx=True, ex=self.lease_ttl):
+                self.owned.add(shard)
+                gained.add(shard)
+        while len(self.owned) > target:
+            shard = max(self.owned)
+            self.if_holding(shard, "release")
+            self.owned.discard(shard)
+            lost.add(shard)
+        return gained, lost
+
+    def renew(self):
+        # Keeps held leases and this worker's liveness fresh; gaining and giving up shards is
+        # left to heartbeat.
+        for shard in list(self.owned):
+            self.if_holding(shard, "renew")
+        self.r.zadd("workers", {self.worker_id: time()})
+
+    def keep_alive(self):
+        # Renews from a thread of its own, so a main loop stuck in refresh retries for longer
+        # than lease_ttl doesn't lose this worker its shards.
+        def run():
+            while True:
+                sleep(self.heartbeat_every)
+                try:
+                    self.renew()
+                except RedisError as e:
+                    print(f"Lease renewal failed: {e}")
+
+        threading.Thread(target=run, name="leases", daemon=True).start()
+
+    def release(self):
+        for shard in self.owned:
+            self.if_holding(shard, "release")
+        self.r.zrem("workers", self.worker_id)
+        self.owned = set()
+
+    def handoff(self, name, created, expires):
+        with self.lock:
+            self.handoffs[shard_of(name, self.shard_count)].append(f"{name} {created} {expires}")
+
+    def flush_handoffs(self):
+        with self.lock:
+            handoffs = self.handoffs
+            self.handoffs = defaultdict(list)
+        if not handoffs:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for shard, entries in handoffs.items():
+            pipe.rpush(self.jobs_key(shard), *entries)
+        try:
+            pipe.execute()
+        except RedisError:
+            with self.lock:
+                for shard, entries in handoffs.items():
+                    self.handoffs[shard] = entries + self.handoffs[shard]
+            raise
+
+    def receive(self):
+        if not self.owned:
+            return []
+        pipe = self.r.pipeline(transaction=True)
+        for shard in self.owned:
+            pipe.lrange(self.jobs_key(shard), 0, -1)
+            pipe.delete(self.jobs_key(shard))
+        results = pipe.execute()
+        jobs = []
+        for entries in results[::2]:
+            for entry in entries:
+                name, created, expires = entry.split(" ")
+                jobs.append((name, float(created), float(expires)))
+        return jobs
@@ -0,0 +1,141 @@
+import threading
+from time import time
+import numpy as np
+from redis.exceptions import RedisError
+
+
+class SpikeDetector:
+    # Per-ticker mention counts and summed sentiment in per-minute ring buffers (one row per
+    # ticker, one column per minute of the window). Every few seconds the last `recent`
+    # minutes are compared with the rest of the window for all tickers at once, and tickers
+    # whose mention rate jumps by `z_threshold` standard deviations are added to a Redis stream.
+    def __init__(
+        self,
+        r=None,
+        stream="ticker_alerts",
+        window=180,
+        recent=5,
+        check_every=5,
+        min_mentions=10,
+        z_threshold=4.0,
+        cooldown=15 * 60,
+        maxlen=10000,
+        min_baseline=30,
+    ):
+        self.r = r
+        self.stream = stream
+        self.window = window
+        self.recent = recent
+        self.check_every = check_every
+        self.min_mentions = min_mentions
+        self.z_threshold = z_threshold
+        self.cooldown = cooldown
+        self.maxlen = maxlen
+        self.min_baseline = min_baseline
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.tickers = []
+        self.mentions = np.zeros((64, window), dtype=np.int32)
+        self.sentiment = np.zeros((64, window), dtype=np.float32)
+        self.last_alert = np.zeros(64, dtype=np.float64)
+        self.minute = int(time() // 60)
+        # Minutes up to this one (started partway through) were never observed, so they're
+        # kept out of the baseline rather than counted as silent.
+        self.started = self.minute
+        self.last_check = time()
+        self.alerts = 0
+
+    def row(self, ticker):
+        row = self.rows.get(ticker)
+        if row is None:
+            row = len(self.tickers)
+            if row == len(self.mentions):
+                self.mentions = np.concatenate([self.mentions, np.zeros_like(self.mentions)])
+                self.sentiment = np.concatenate([self.sentiment, np.zeros_like(self.sentiment)])
+                self.last_alert = np.concatenate([self.last_alert, np.zeros_like(self.last_alert)])
+            self.rows[ticker] = row
+            self.tickers.append(ticker)
+        return row
+
+    def advance(self, minute):
+        # Clears the columns of minutes the ring buffer is moving past.
+        if minute <= self.minute:
+            return
+        steps = min(minute - self.minute, self.window)
+        columns = [(self.minute + i) % self.window for i in range(1, steps + 1)]
+        self.mentions[:, columns] = 0
+        self.sentiment[:, columns] = 0.0
+        self.minute = minute
+
+    def observe(self, tickers, sentiment, created):
+        if not tickers:
+            return
+        minute = int(created // 60)
+        with self.lock:
+            self.advance(max(minute, int(time() // 60)))
+            if minute <= self.minute - self.window or minute > self.minute:
+                return
+            column = minute % self.window
+            for ticker in tickers:
+                row = self.row(ticker)
+                self.mentions[row, column] += 1
+                self.sentiment[row, column] += sentiment
+
+    def maybe_check(self):
+        if time() - self.last_check >= self.check_every:
+            return self.check()
+        return []
+
+    def check(self, now=None):
+        now = now or time()
+        self.last_check = now
+        with self.lock:
+            self.advance(int(now // 60))
+            n = len(self.tickers)
+            baseline_minutes = min(self.window - self.recent, self.minute - self.started - self.recent)
+            if n == 0 or baseline_minutes < self.min_baseline:
+                return []
+            offsets = (self.minute - np.arange(self.recent + baseline_minutes)) % self.window
+            recent, baseline = offsets[: self.recent], offsets[self.recent :]
+            counts = self.mentions[:n]
+            recent_counts = counts[:, recent].sum(axis=1)
+            base = counts[:, baseline]
+            rate = recent_counts / self.recent
+            base_mean = base.mean(axis=1)
+            # A floor of one mention per minute keeps tickers that are normally silent from
+            # alerting on a couple of mentions.
+            z = (rate - base_mean) / np.maximum(base.std(axis=1), 1.0)
+            hits = np.flatnonzero(
+                (recent_counts >= self.min_mentions)
+                & (z >= self.z_threshold)
+                & (now - self.last_alert[:n] >= self.cooldown)
+            )
+            self.last_alert[hits] = now
+            recent_sentiment = self.sentiment[:n][:, recent].sum(axis=1)
+            alerts = [
+                {
+                    "ticker": self.tickers[row],
+                    "mentions": int(recent_counts[row]),
+                    "baseline": float(base_mean[row]),
+                    "z": float(z[row]),
+                    "sentiment": float(recent_sentiment[row] / recent_counts[row]),
+                    "time": now,
+                }
+                for row in hits
+            ]
+        if alerts:
+            self.alerts += len(alerts)
+            self.emit(alerts)
+        return alerts
+
+    def emit(self, alerts):
+        if self.r is None:
+            return
+        pipe = self.r.pipeline(transaction=False)
+        for alert in alerts:
+            fields = {key: str(value) for key, value in alert.items()}
+            pipe.xadd(self.stream, fields, maxlen=self.maxlen, approximate=True)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            print(f"Publishing {len(alerts)} spike alerts failed: {e}")
@@ -0,0 +1,298 @@
+import json
+import mmap
+import os
+import random
+import struct
+import threading
+import zlib
+from time import sleep, time
+import psycopg2
+from bulk_writer import copy_rows
+
+# payload length, crc32 of the payload, unix time appended
+HEADER = struct.Struct("<IId")
+# Table name of the records that carry stream checkpoints rather than rows
+CHECKPOINT = "checkpoint"
+
+
+class Spool:
+    # Append-only log of COPY batches on their way to Postgres, in memory-mapped segment files
+    # (<seq>.spool) preallocated to `segment_size`. A record is HEADER then "table\tcolumns\n"
+    # and the COPY text; the zeroed rest of a segment reads as a zero length. The `cursor` file
+    # holds how far replay has got, and segments behind it are deleted.
+    def __init__(self, directory, segment_size=16 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+        self.appended = threading.Condition(self.lock)
+        os.makedirs(directory, exist_ok=True)
+        self.read_seq, self.read_offset = self.load_cursor()
+        # seq -> mmap, and seq -> end of the records in it, for every segment not yet replayed
+        self.maps = {}
+        self.ends = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".spool"):
+                continue
+            seq = int(name[: -len(".spool")])
+            path = self.path(seq)
+            if seq < self.read_seq or os.path.getsize(path) == 0:
+                os.remove(path)
+                continue
+            self.maps[seq] = self.open(seq)
+            self.ends[seq] = self.scan(self.maps[seq])
+        if self.read_seq not in self.maps:
+            self.read_seq, self.read_offset = min(self.maps, default=self.read_seq), 0
+        # Appends go to a fresh segment, so nothing is ever written after a record torn by a crash.
+        self.write_seq = max(self.maps, default=self.read_seq - 1) + 1
+        self.write_offset = 0
+        self.maps[self.write_seq] = self.open(self.write_seq, self.segment_size)
+        self.ends[self.write_seq] = 0
+
+    def path(self, seq):
+        return os.path.join(self.directory, f"{seq:012d}.spool")
+
+    def open(self, seq, size=None):
+        with open(self.path(seq), "r+b" if size is None else "w+b") as f:
+            if size is not None:
+                # Allocated up front: a write to a sparse mapping on a full disk would be a SIGBUS.
+                os.posix_fallocate(f.fileno(), 0, size)
+            return mmap.mmap(f.fileno(), 0)
+
+    def scan(self, mm):
+        offset = 0
+        while offset + HEADER.size <= len(mm):
+            length, crc, _ = HEADER.unpack_from(mm, offset)
+            start, end = offset + HEADER.size, offset + HEADER.size + length
+            if length == 0 or end > len(mm) or zlib.crc32(mm[start:end]) != crc:
+                break
+            offset = end
+        return offset
+
+    def load_cursor(self):
+        try:
+            with open(os.path.join(self.directory, "cursor")) as f:
+                seq, offset = f.read().split()
+            return int(seq), int(offset)
+        except FileNotFoundError:
+            return 0, 0
+
+    def store_cursor(self):
+        path = os.path.join(self.directory, "cursor")
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self.read_seq} {self.read_offset}")
+        os.replace(path + ".tmp", path)
+
+    def append(self, table, columns, data):
+        payload = f"{table}\t{','.join(columns)}\n{data}".encode("utf-8")
+        record = HEADER.pack(len(payload), zlib.crc32(payload), time()) + payload
+        with self.lock:
+            if self.write_offset + len(record) > len(self.maps[self.write_seq]):
+                self.maps[self.write_seq].flush()
+                self.write_seq += 1
+                self.write_offset = 0
+                self.maps[self.write_seq] = self.open(self.write_seq, max(self.segment_size, len(record)))
+            self.maps[self.write_seq][self.write_offset : self.write_offset + len(record)] = record
+            self.write_offset += len(record)
+            self.ends[self.write_seq] = self.write_offset
+            self.appended.notify_all()
+
+    def append_checkpoint(self, state):
+        self.append(CHECKPOINT, [], json.dumps(state))
+
+    def sync(self):
+        with self.lock:
+            self.maps[self.write_seq].flush()
+
+    def next_record(self, seq, offset):
+        # The segment and offset of the first record at or after (seq, offset), if there is one.
+        for s in sorted(self.maps):
+            if s < seq:
+                continue
+            if s > seq:
+                offset = 0
+            if offset < self.ends[s]:
+                return s, offset
+        return None
+
+    def pending_bytes(self):
+        with self.lock:
+            return sum(self.ends.values()) - self.read_offset
+
+    def lag(self):
+        with self.lock:
+            position = self.next_record(self.read_seq, self.read_offset)
+            if position is None:
+                return 0.0
+            seq, offset = position
+            return time() - HEADER.unpack_from(self.maps[seq], offset)[2]
+
+    def read(self, max_bytes, timeout=None):
+        # Records from the cursor on, up to about max_bytes of them, and the position after them.
+        # Only one thread reads; the cursor moves when it commits that position.
+        payloads = []
+        seq, offset = self.read_seq, self.read_offset
+        size = 0
+        with self.lock:
+            self.appended.wait_for(lambda: self.next_record(seq, offset) is not None, timeout)
+            while size < max_bytes:
+                position = self.next_record(seq, offset)
+                if position is None:
+                    break
+                seq, offset = position
+                length = HEADER.unpack_from(self.maps[seq], offset)[0]
+                start = offset + HEADER.size
+                payloads.append(self.maps[seq][start : start + length])
+                offset = start + length
+                size += length
+        records = []
+        for payload in payloads:
+            head, data = payload.decode("utf-8").split("\n", 1)
+            table, columns = head.split("\t")
+            records.append((table, columns.split(","), data))
+        return records, (seq, offset)
+
+    def commit(self, position):
+        with self.lock:
+            self.read_seq, self.read_offset = position
+            done = [seq for seq in self.maps if seq < self.read_seq]
+            for seq in done:
+                self.maps.pop(seq).close()
+                self.ends.pop(seq)
+            self.store_cursor()
+        for seq in done:
+            os.remove(self.path(seq))
+
+    def close(self):
+        with self.lock:
+            for mm in self.maps.values():
+                mm.flush()
+
+
+class SpoolFlusher(threading.Thread):
+    # Replays the spool into Postgres in order, one transaction per batch, reconnecting with
+    # jittered exponential backoff while the database is unreachable. Delivery is at least
+    # once: a batch committed just before a crash, with the cursor not yet moved, is loaded again.
+    # A checkpoint record is handed to `on_checkpoint` once every row spooled before it is
+    # committed, so nothing is marked as ingested while it only exists on local disk.
+    def __init__(
+        self, spool, connect, batch_bytes=4 * 1024 * 1024, base_delay=1.0, max_delay=60.0, on_checkpoint=None
+    ):
+        super().__init__(name="spool", daemon=True)
+        self.spool = spool
+        self.connect = connect
+        self.batch_bytes = batch_bytes
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.on_checkpoint = on_checkpoint
+        self.connection = None
+        self.rows = 0
+        self.errors = 0
+        self.rejected = 0
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                records, position = self.spool.read(self.batch_bytes, timeout=1.0)
+                if records:
+                    self.load(records)
+                    self.spool.commit(position)
+        except Exception as e:
+            self.error = e
+            raise
+
+    def load(self, records):
+        batch = []
+        for record in records:
+            table, _, data = record
+            if table != CHECKPOINT:
+                batch.append(record)
+                continue
+            if batch:
+                self.replay(batch)
+                batch = []
+            if self.on_checkpoint is not None:
+                self.on_checkpoint(json.loads(data))
+        if batch:
+            self.replay(batch)
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def replay(self, records):
+        attempt = 0
+        while True:
+            try:
+                self.copy(records)
+                return
+            except psycopg2.Error as e:
+                self.errors += 1
+                if not self.connection_lost(e):
+                    self.split(records, e)
+                    return
+                self.disconnect()
+                delay = self.backoff(attempt)
+                attempt += 1
+                print(f"Spool replay failed, retrying in {delay:.1f}s: {e}")
+                sleep(delay)
+
+    def connection_lost(self, e):
+        # Only a lost connection (or a server shutting down) is waited out; any other error is
+        # down to the rows, and retrying them would stall the spool behind them for good.
+        if isinstance(e, psycopg2.InterfaceError) or self.connection is None or self.connection.closed:
+            return True
+        code = e.pgcode or ""
+        return code.startswith("08") or code in ("57P01", "57P02", "57P03")
+
+    def split(self, records, e):
+        # Rows Postgres refuses would hold up everything behind them, so the batch is
+        # split in halves (records, then rows) until only the failing rows are left,
+        # and those are set aside.
+        if len(records) > 1:
+            half = len(records) // 2
+            self.replay(records[:half])
+            self.replay(records[half:])
+            return
+        table, columns, data = records[0]
+        # COPY text escapes newlines inside values, so each "\n" ends a row.
+        rows = [row + "\n" for row in data.split("\n")[:-1]]
+        if len(rows) > 1:
+            half = len(rows) // 2
+            self.replay([(table, columns, "".join(rows[:half]))])
+            self.replay([(table, columns, "".join(rows[half:]))])
+            return
+        self.reject(records[0], e)
+
+    def copy(self, records):
+        if self.connection is None:
+            self.connection = self.connect()
+        with self.connection:
+            with self.connection.cursor() as cursor:
+                for table, columns, data in records:
+                    copy_rows(cursor, table, columns, data)
+        self.rows += sum(data.count("\n") for _, _, data in records)
+
+    def disconnect(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except psycopg2.Error:
+                pass
+        self.connection = None
+
+    def reject(self, record, error):
+        table, columns, data = record
+        rows = data.count("\n")
+        directory = os.path.join(self.spool.directory, "rejected")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{table}-{time():.6f}.copy")
+        with open(path, "w") as f:
+            f.write(f"{','.join(columns)}\n{data}")
+        self.rejected += rows
+        print(f"Postgres rejected {rows} {table} rows ({error}), saved to {path}")
+
+    def drain(self, timeout):
+        deadline = time() + timeout
+        while self.spool.pending_bytes() > 0 and self.is_alive() and time() < deadline:
+            sleep(0.1)
+        return self.spool.pending_bytes() == 0
@@ -0,0 +1,282 @@
+import json
+import os
+import select
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+from urllib.parse import parse_qs, urlparse
+import psycopg2
+import ids
+
+# Leaderboards precomputed after every rollup: metric -> expression over a tickers row.
+LEADERBOARD_METRICS = {
+    "mentions": "comment_mentions + post_title_mentions + post_text_mentions",
+    "upvotes": "comment_upvotes + post_title_upvotes + post_text_upvotes",
+}
+LEADERBOARD_WINDOWS = (1, 4, 24, 72)
+LEADERBOARD_SIZE = 100
+CHANNEL = "tickers_updated"
+
+
+def refresh_leaderboards(cursor):
+    # Runs inside the rollup transaction; NOTIFY is only delivered once it commits.
+    selects = []
+    for metric, expression in LEADERBOARD_METRICS.items():
+        for window in LEADERBOARD_WINDOWS:
+            selects.append(
+                f"""
+                SELECT '{metric}' AS metric, {window} AS window_hours, ticker, SUM({expression}) AS value
+                FROM tickers
+                WHERE date >= date_trunc('hour', now()) - interval '{window - 1} hours'
+                GROUP BY ticker
+                """
+            )
+    cursor.execute(
+        f"""
+        DELETE FROM ticker_leaderboards;
+        INSERT INTO ticker_leaderboards (metric, window_hours, position, ticker, value)
+        SELECT metric, window_hours, position, ticker, value
+        FROM (
+          SELECT *, row_number() OVER (PARTITION BY metric, window_hours ORDER BY value DESC, ticker) AS position
+          FROM ({" UNION ALL ".join(selects)}) a
+        ) b
+        WHERE position <= {LEADERBOARD_SIZE};
+        NOTIFY {CHANNEL};
+        """
+    )
+
+
+class TTLCache:
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] <= time():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class TickerReader:
+    # Reads for dashboards. Results are cached until the TTL runs out or the updater
+    # announces a new rollup on the tickers_updated channel, whichever comes first.
+    # Queries can go to a follower (READ_DATABASE_URL), but a hot standby can't LISTEN and
+    # never sees the primary's NOTIFYs, so the listener is always on DATABASE_URL.
+    def __init__(self, connection=None, listener=None, cache_size=1024, ttl=60):
+        # Only connections the reader opened itself are reopened when they drop.
+        self.urls = None
+        if connection is None:
+            url = os.environ.get("READ_DATABASE_URL") or os.environ["DATABASE_URL"]
+            if listener is None:
+                self.urls = (url, os.environ["DATABASE_URL"])
+            else:
+                connection = psycopg2.connect(url, sslmode="require")
+        self.connection = connection
+        self.listener = listener or connection
+        self.cache = TTLCache(cache_size, ttl)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.reconnects = 0
+        if self.urls is not None:
+            self.connect()
+        else:
+            self.listen()
+
+    def connect(self):
+        url, listen_url = self.urls
+        self.connection = psycopg2.connect(url, sslmode="require")
+        self.listener = self.connection
+        if listen_url != url:
+            self.listener = psycopg2.connect(listen_url, sslmode="require")
+        self.listen()
+
+    def listen(self):
+        self.connection.autocommit = True
+        # LISTEN only takes effect once committed.
+        self.listener.autocommit = True
+        with self.listener.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL};")
+
+    def lost(self, e):
+        return isinstance(e, psycopg2.InterfaceError) or self.connection.closed or self.listener.closed
+
+    def reconnect(self, e):
+        # Called with the lock held. NOTIFYs sent while the listener was down are gone, so the
+        # cache is dropped along with the old connections.
+        if self.urls is None or not self.lost(e):
+            raise e
+        for connection in {self.connection, self.listener}:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+        print(f"Database connection lost, reconnecting: {e}")
+        self.connect()
+        self.reconnects += 1
+        self.generation += 1
+        self.cache.clear()
+
+    def invalidate_if_updated(self):
+        with self.lock:
+            try:
+                if select.select([self.listener], [], [], 0) == ([], [], []):
+                    return False
+                self.listener.poll()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                self.reconnect(e)
+                return True
+            updated = bool(self.listener.notifies)
+            self.listener.notifies.clear()
+            if updated:
+                self.generation += 1
+        if updated:
+            self.cache.clear()
+        return updated
+
+    def query(self, key, sql, params, transform=None):
+        self.invalidate_if_updated()
+        rows = self.cache.get(key)
+        if rows is None:
+            with self.lock:
+                try:
+                    rows = self.fetch(sql, params)
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    self.reconnect(e)
+                    rows = self.fetch(sql, params)
+                generation = self.generation
+            if transform is not None:
+                rows = [transform(row) for row in rows]
+            # Don't cache a result that raced a rollup announcement.
+            self.invalidate_if_updated()
+            if generation == self.generation:
+                self.cache.put(key, rows)
+        return rows
+
+    def fetch(self, sql, params):
+        with self.connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            columns = [x[0] for x in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def series(self, ticker, hours=24):
+        return self.query(
+            ("series", ticker.upper(), hours),
+            """
+            SELECT
+              date,
+              comment_mentions + post_title_mentions + post_text_mentions AS mentions,
+              comment_upvotes + post_title_upvotes + post_text_upvotes AS upvotes,
+              comment_replies + post_title_replies + post_text_replies AS replies,
+              comment_sentiment,
+              post_title_sentiment,
+              post_text_sentiment
+            FROM tickers
+            WHERE ticker = %(ticker)s AND date >= date_trunc('hour', now()) - %(hours)s * interval '1 hour'
+            ORDER BY date;
+            """,
+            {"ticker": ticker.upper(), "hours": hours - 1},
+        )
+
+    def mentions(self, ticker, hours=6, limit=1000):
+        # A range scan on mentions (ticker, posted), newest first.
+        def with_fullname(row):
+            row["id"] = ids.fullname(1 if row["source"] == 1 else 3, row.pop("item_id"))
+            return row
+
+        return self.query(
+            ("mentions", ticker.upper(), hours, limit),
+            """
+            SELECT posted, item_id, source, sentiment FROM mentions
+            WHERE ticker = %(ticker)s AND posted >= now() - %(hours)s * interval '1 hour'
+            ORDER BY posted DESC
+            LIMIT %(limit)s;
+            """,
+            {"ticker": ticker.upper(), "hours": hours, "limit": limit},
+            with_fullname,
+        )
+
+    def top(self, k=10, metric="mentions", window=24):
+        if metric not in LEADERBOARD_METRICS:
+            raise ValueError(f"unknown metric {metric!r}")
+        if window in LEADERBOARD_WINDOWS and k <= LEADERBOARD_SIZE:
+            return self.query(
+                ("top", metric, window, k),
+                """
+                SELECT ticker, value FROM ticker_leaderboards
+                WHERE metric = %(metric)s AND window_hours = %(window)s AND position <= %(k)s
+                ORDER BY position;
+                """,
+                {"metric": metric, "window": window, "k": k},
+            )
+        # Windows that aren't precomputed fall back to aggregating tickers.
+        return self.query(
+            ("top", metric, window, k),
+            f"""
+            SELECT ticker, SUM({LEADERBOARD_METRICS[metric]}) AS value
+            FROM tickers
+            WHERE date >= date_trunc('hour', now()) - %(hours)s * interval '1 hour'
+            GROUP BY ticker
+            ORDER BY value DESC, ticker
+            LIMIT %(k)s;
+            """,
+            {"hours": window - 1, "k": k},
+        )
+
+
+def serve(reader, port, host="0.0.0.0"):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                if url.path == "/series" and "ticker" in params:
+                    body = reader.series(params["ticker"], int(params.get("hours", 24)))
+                elif url.path == "/mentions" and "ticker" in params:
+                    body = reader.mentions(params["ticker"], int(params.get("hours", 6)), int(params.get("limit", 1000)))
+                elif url.path == "/top":
+                    body = reader.top(
+                        int(params.get("k", 10)), params.get("metric", "mentions"), int(params.get("window", 24))
+                    )
+                else:
+                    self.send_error(404)
+                    return
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+            data = json.dumps(body, default=str).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    serve(TickerReader(), int(os.environ.get("PORT", "8000")))
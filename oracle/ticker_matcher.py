@@ -0,0 +1,64 @@
+import mmap
+import os
+import re
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE_PATH = os.path.join(HERE, "tickers.py")
+COMPILED_PATH = os.path.join(HERE, "tickers.bin")
+MAGIC = b"TICKERS1\n"
+
+# Same word characters as flashtext's default non_word_boundaries. As with flashtext, a "$"
+# only starts a cashtag at the start of a word ("spg$PM" is SPG alone), while a bare symbol
+# still matches after one ("a$gme" is GME).
+TOKEN = re.compile(r"((?<![A-Za-z0-9_])\$)?([A-Za-z0-9_]+)")
+SYMBOL = re.compile(r"\$?[A-Z0-9_]+")
+
+
+def compile_tickers(path=COMPILED_PATH):
+    # Every ticker is a single token, so instead of an automaton, matching is the token regex
+    # above plus two symbol sets. The compiled file is just the sorted symbols, one per line,
+    # split into those sets on load; symbols starting with "$" ("$V", "$IT") are only matched
+    # as cashtags. Entries that aren't a single token are left out: the only ones are padded
+    # with trailing spaces ("SAND          "), which flashtext matched solely when the word
+    # was followed by that many spaces.
+    from tickers import NYSE, NASDAQ, AMEX
+
+    symbols = sorted(set(x for x in NYSE + NASDAQ + AMEX if SYMBOL.fullmatch(x)))
+    # A unique temporary name, as several workers may compile at once.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".")
+    with os.fdopen(fd, "wb") as f:
+        f.write(MAGIC)
+        f.write("\n".join(symbols).encode("ascii"))
+    os.replace(tmp_path, path)
+
+
+class TickerMatcher:
+    def __init__(self, path=COMPILED_PATH):
+        if not os.path.exists(path) or (
+            os.path.exists(SOURCE_PATH) and os.path.getmtime(SOURCE_PATH) > os.path.getmtime(path)
+        ):
+            compile_tickers(path)
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[: len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{path} is not a compiled ticker file")
+                symbols = data[len(MAGIC) :].decode("ascii").split("\n")
+        self.plain = frozenset(x for x in symbols if not x.startswith("$"))
+        self.cash_only = frozenset(x[1:] for x in symbols if x.startswith("$"))
+
+    def extract(self, text):
+        found = set()
+        for dollar, token in TOKEN.findall(text):
+            symbol = token.upper()
+            if symbol in self.plain or (dollar and symbol in self.cash_only):
+                found.add(symbol)
+        return list(found)
+
+    def extract_batch(self, texts):
+        return [self.extract(text) for text in texts]
+
+
+if __name__ == "__main__":
+    compile_tickers()
+    print(f"compiled {COMPILED_PATH}")